@@ -45,7 +45,9 @@ class Client:
                                     'Content-Type': 'application/json'},
                    params: dict = {},
                    json_data: dict = {}) -> dict:
-        '''POST mothod: all types'''
+        '''POST mothod: all types.
+        Return a json if request is done (200) or accepted (202),
+        otherwise None.'''
 
         async with aiohttp.ClientSession() as session:
             async with session.post(
@@ -54,9 +56,8 @@ class Client:
                 headers=headers,
                 json=json_data
             ) as resp:
-                status = resp.status
-        if status == 200:
-            return await resp.json()
+                if resp.status in (200, 202):
+                    return await resp.json()
 
     @staticmethod
     async def delete(entity: str,
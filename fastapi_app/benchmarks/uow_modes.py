@@ -0,0 +1,94 @@
+'''Compare unit_of_work modes on the read behind /user/{user_id}.
+
+"legacy" is the unit of work before modes: a session and a transaction
+around every call. "read" and "write" open no session, "transaction"
+runs the read in a real transaction (skipped without a replica set).
+Prints per-request latency and the saving against "legacy".
+
+Run from fastapi_app directory:
+    python -m benchmarks.uow_modes 2741715718 --repeat 1000'''
+
+import argparse
+import asyncio
+import statistics
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from pymongo.errors import OperationFailure
+from mongodb import MongoRepo, unit_of_work, connect, disconnect
+
+
+MODES = ['legacy', 'read', 'write', 'transaction']
+
+
+@asynccontextmanager
+async def legacy_unit_of_work(collection: str):
+    m = MongoRepo(collection=collection)
+    async with await m.client.start_session() as s:
+        async with s.start_transaction():
+            yield m
+
+
+def factory(mode: str):
+    if mode == 'legacy':
+        return legacy_unit_of_work
+    return partial(unit_of_work, mode=mode)
+
+
+async def get_user(uow_factory, user_id: int) -> dict | None:
+    '''Same read as Users.get_user.'''
+
+    async with uow_factory('users') as uow:
+        return await uow.find_id({'user_id': user_id}, {'_id': 0})
+
+
+async def measure(mode: str, user_id: int, repeat: int) -> list[float]:
+    uow_factory = factory(mode)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await get_user(uow_factory, user_id)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+async def run(user_id: int, repeat: int) -> dict[str, list[float]]:
+    connect()
+    try:
+        if await get_user(factory('read'), user_id) is None:
+            print(f'user {user_id} not found, timing a miss')
+
+        results = {}
+        for mode in MODES:
+            try:
+                results[mode] = await measure(mode, user_id, repeat)
+            except OperationFailure as e:
+                print(f'{mode}: skipped, {e.details.get("errmsg", e)}')
+        return results
+    finally:
+        disconnect()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('user_id', type=int)
+    parser.add_argument('--repeat', type=int, default=1000)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.user_id, args.repeat))
+
+    legacy = statistics.median(results['legacy'])
+    print(f'{args.repeat} requests per mode, milliseconds')
+    print(f"{'':12}{'median':>10}{'p95':>10}{'mean':>10}{'saving':>10}")
+    for mode, times in results.items():
+        times = sorted(times)
+        median = statistics.median(times)
+        print(f'{mode:12}'
+              f'{median * 1000:>10.3f}'
+              f'{times[int(len(times) * 0.95) - 1] * 1000:>10.3f}'
+              f'{statistics.mean(times) * 1000:>10.3f}'
+              f'{(legacy - median) * 1000:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
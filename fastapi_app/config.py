@@ -7,3 +7,52 @@ REDIS: str = os.getenv('REDIS')
 MLFLOW_CLIENT: str = os.getenv('MLFLOW_CLIENT')
 MLFLOW_SERVER: str = os.getenv('MLFLOW_SERVER')
 DATABASE: str = os.getenv('DATABASE')
+PRICES_RETENTION_DAYS: int = int(os.getenv('PRICES_RETENTION_DAYS', 89))
+
+# mongodb connection pool
+MONGO_MAX_POOL_SIZE: int = int(os.getenv('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE: int = int(os.getenv('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_IDLE_TIME_MS: int = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 60_000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS: int = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5_000))
+MONGO_CONNECT_TIMEOUT_MS: int = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5_000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS: int = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5_000))
+
+# chart rendering process pool
+RENDER_WORKERS: int = int(os.getenv('RENDER_WORKERS', 2))
+RENDER_MAX_QUEUE: int = int(os.getenv('RENDER_MAX_QUEUE', 16))
+
+# chart encoding: png, jpeg or webp
+CHART_FORMAT: str = os.getenv('CHART_FORMAT', 'png')
+CHART_QUALITY: int = int(os.getenv('CHART_QUALITY', 80))
+CHART_PNG_COLORS: int = int(os.getenv('CHART_PNG_COLORS', 64))
+
+# outbound http sessions
+HTTP_POOL_LIMIT: int = int(os.getenv('HTTP_POOL_LIMIT', 100))
+HTTP_DNS_CACHE_TTL: int = int(os.getenv('HTTP_DNS_CACHE_TTL', 300))
+HTTP_KEEPALIVE_TIMEOUT: float = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', 30))
+HTTP_RETRIES: int = int(os.getenv('HTTP_RETRIES', 2))
+HTTP_RETRY_BACKOFF: float = float(os.getenv('HTTP_RETRY_BACKOFF', 0.5))
+
+# forecast results cache, seconds
+FORECAST_CACHE_TTL: int = int(os.getenv('FORECAST_CACHE_TTL', 60 * 60 * 24 * 2))
+
+# fallback cache of latest run looked up in mlflow server, seconds
+MODEL_URI_TTL: int = int(os.getenv('MODEL_URI_TTL', 60))
+
+# telegram file_id cache of charts, seconds; keys carry the data version
+CHART_CACHE_TTL: int = int(os.getenv('CHART_CACHE_TTL', 60 * 60 * 24))
+# render and upload of one chart across workers, seconds
+CHART_LOCK_TIMEOUT: int = int(os.getenv('CHART_LOCK_TIMEOUT', 60))
+
+# chart warm-up after data refresh: most requested charts are uploaded to STORAGE_CHAT
+STORAGE_CHAT: str | None = os.getenv('STORAGE_CHAT')
+CHART_WARM_TOP: int = int(os.getenv('CHART_WARM_TOP', 50))
+
+# background delivery of charts and forecasts
+DELIVERY_WORKERS: int = int(os.getenv('DELIVERY_WORKERS', 8))
+DELIVERY_MAX_QUEUE: int = int(os.getenv('DELIVERY_MAX_QUEUE', 256))
+DELIVERY_JOB_TTL: int = int(os.getenv('DELIVERY_JOB_TTL', 60 * 60))
+
+# telegram bot api retries, "retry_after" of 429 responses is respected
+TELEGRAM_RETRIES: int = int(os.getenv('TELEGRAM_RETRIES', 3))
+TELEGRAM_RETRY_BACKOFF: float = float(os.getenv('TELEGRAM_RETRY_BACKOFF', 1))
@@ -1,9 +1,33 @@
 import uvicorn
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from routers import other, users, pairs
-
-
-app = FastAPI()
+from mongodb import connect, disconnect, ensure_prices_collection
+from mongodb.indexes import ensure_indexes
+from models import coin_cache, render_pool, http_clients, delivery_queue
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    '''Create shared resources once per process.'''
+
+    connect()
+    await ensure_prices_collection()
+    await ensure_indexes()
+    await coin_cache.load()
+    listener = asyncio.create_task(coin_cache.listen())
+    await render_pool.start()
+    await delivery_queue.start()
+    yield
+    await delivery_queue.shutdown()
+    render_pool.shutdown()
+    listener.cancel()
+    await http_clients.close()
+    disconnect()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 app.include_router(users.router)
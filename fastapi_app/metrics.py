@@ -0,0 +1,122 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+__all__ = [
+    'Histogram',
+    'Gauge',
+    'histogram',
+    'gauge',
+    'snapshot'
+]
+
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    '''Thread-safe latency histogram with fixed buckets (seconds).'''
+
+    def __init__(self, name: str, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._count += 1
+            self._sum += value
+            self._max = max(self._max, value)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+
+    @contextmanager
+    def time(self):
+        '''Observe the duration of the wrapped block.'''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [f'le_{bound}' for bound in self.buckets] + ['le_inf']
+            return {
+                'count': self._count,
+                'sum': round(self._sum, 6),
+                'avg': round(self._sum / self._count, 6) if self._count else 0.0,
+                'max': round(self._max, 6),
+                'buckets': dict(zip(labels, self._counts))
+            }
+
+
+class Gauge:
+    '''Thread-safe value which can go up and down.'''
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: int) -> None:
+        with self._lock:
+            self._value = value
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def snapshot(self) -> int:
+        return self._value
+
+
+_registry: dict[str, Histogram | Gauge] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(name: str, cls):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name)
+        return metric
+
+
+def histogram(name: str) -> Histogram:
+    '''Return a process-wide histogram by name, create it if needed.'''
+
+    return _get_or_create(name, Histogram)
+
+
+def gauge(name: str) -> Gauge:
+    '''Return a process-wide gauge by name, create it if needed.'''
+
+    return _get_or_create(name, Gauge)
+
+
+def snapshot() -> dict:
+    '''Return current values of all registered metrics.'''
+
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {metric.name: metric.snapshot() for metric in sorted(metrics, key=lambda m: m.name)}
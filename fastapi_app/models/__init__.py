@@ -2,3 +2,9 @@ from .repository import *
 from .models import *
 from .misc import *
 from .exc import *
+from .coins import *
+from .render import *
+from .upstream import *
+from .columnar import *
+from .singleflight import *
+from .delivery import *
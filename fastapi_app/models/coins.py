@@ -0,0 +1,86 @@
+__all__ = [
+    'CoinCache',
+    'coin_cache'
+]
+
+
+import asyncio
+import logging
+import uuid
+import aioredis
+from mongodb import unit_of_work
+from config import REDIS
+
+
+logger = logging.getLogger(__name__)
+
+
+class CoinCache:
+    '''In-process sets of CoinGecko coin ids and supported vs_currencies.
+
+    Loaded from "other" collection at startup. After Other.update
+    every worker reloads it by a message in Redis channel.'''
+
+    CHANNEL = 'coins:invalidate'
+
+    def __init__(self) -> None:
+        self.coin_ids: frozenset[str] = frozenset()
+        self.vs_currencies: frozenset[str] = frozenset()
+        self.loaded = False
+        self._worker_id = uuid.uuid4().hex
+
+    @staticmethod
+    def _data(doc: dict | None) -> list:
+        if doc is None:
+            return []
+        data = doc['data']
+        # documents written by the old Other.update keep the list one level deeper
+        if isinstance(data, dict):
+            data = data['data']
+        return data
+
+    async def load(self) -> None:
+        '''Read coins list and vs_currencies from database.'''
+
+        async with unit_of_work('other', mode='read') as uow:
+            vs_currencies = await uow.find_id({'name': 'supported_vs_currencies'}, {'_id': 0, 'data': 1})
+            coins_list = await uow.find_id({'name': 'coins_list'}, {'_id': 0, 'data.id': 1, 'data.data.id': 1})
+
+        self.vs_currencies = frozenset(self._data(vs_currencies))
+        self.coin_ids = frozenset(el['id'] for el in self._data(coins_list))
+        self.loaded = True
+        logger.info(f'Coin cache loaded: {len(self.coin_ids)} coins, {len(self.vs_currencies)} vs_currencies')
+
+    async def invalidate(self) -> None:
+        '''Reload this worker and tell other workers to reload.'''
+
+        await self.load()
+        redis = aioredis.from_url(f'redis://{REDIS}')
+        try:
+            await redis.publish(self.CHANNEL, self._worker_id)
+        finally:
+            await redis.close()
+
+    async def listen(self, retry: float = 5) -> None:
+        '''Reload on invalidation messages from other workers. Runs until cancelled.'''
+
+        while True:
+            redis = aioredis.from_url(f'redis://{REDIS}')
+            try:
+                pubsub = redis.pubsub()
+                await pubsub.subscribe(self.CHANNEL)
+                async for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    if message['data'].decode('utf-8') != self._worker_id:
+                        await self.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'Coin cache listener error: {e}, reconnect in {retry} seconds')
+                await asyncio.sleep(retry)
+            finally:
+                await redis.close()
+
+
+coin_cache = CoinCache()
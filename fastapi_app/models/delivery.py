@@ -0,0 +1,148 @@
+__all__ = [
+    'DeliveryQueue',
+    'delivery_queue'
+]
+
+
+import asyncio
+import json
+import time
+import uuid
+import logging
+from typing import Awaitable, Callable
+from config import DELIVERY_WORKERS, DELIVERY_MAX_QUEUE, DELIVERY_JOB_TTL
+from metrics import histogram, gauge
+from .misc import redis_aio, send_message
+from .exc import DeliveryQueueIsFull, RenderQueueIsFull, MlflowClientError, PairNotInDataBase
+
+
+logger = logging.getLogger(__name__)
+
+
+FAILURE_REASONS = {
+    RenderQueueIsFull: 'too many charts are being drawn right now, try again in a minute',
+    MlflowClientError: 'forecast service is not available, try again later',
+    PairNotInDataBase: 'pair data is not ready yet, try again later',
+}
+
+
+class DeliveryQueue:
+    '''Background delivery of charts and forecasts to Telegram.
+
+    Routers validate a request, submit a job and answer 202 at once.
+    {workers} tasks of this process run jobs, at most {max_queue} wait.
+    Job state lives in Redis "delivery:{job_id}" for {ttl} seconds,
+    so any app worker can report it. If a job fails, the user gets a message.
+    Jobs without a user (chart warm-up) fail silently.
+
+    Job format:
+    {
+        "job_id": "9f1c...",
+        "kind": "chart" | "forecast" | "warm_charts",
+        "user_id": 2741715718 | None,
+        "status": "queued" | "running" | "finished" | "failed",
+        "result": {...} | None,
+        "error": "..." | None,
+        "created_at": 1681324830.1,
+        "finished_at": 1681324831.7 | None
+    }'''
+
+    def __init__(self,
+                 workers: int = DELIVERY_WORKERS,
+                 max_queue: int = DELIVERY_MAX_QUEUE,
+                 ttl: int = DELIVERY_JOB_TTL) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl = ttl
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self.queue_depth = gauge('delivery_queue_depth')
+        self.rejected = gauge('delivery_rejected')
+
+    async def start(self) -> None:
+        # the queue belongs to the running loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _save(self, job: dict) -> None:
+        async with redis_aio() as redis:
+            await redis.set(f"delivery:{job['job_id']}", json.dumps(job), ex=self.ttl)
+
+    async def submit(self, kind: str, user_id: int | None, func: Callable[..., Awaitable], **kwargs) -> dict:
+        '''Queue {func}(**kwargs) delivering {kind} to user. Return the job.'''
+
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'kind': kind,
+            'user_id': user_id,
+            'status': 'queued',
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+            'finished_at': None
+        }
+        try:
+            self._queue.put_nowait((job, func, kwargs, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected.inc()
+            raise DeliveryQueueIsFull()
+        self.queue_depth.inc()
+        await self._save(job)
+        return job
+
+    async def get(self, job_id: str) -> dict | None:
+        async with redis_aio() as redis:
+            job = await redis.get(f'delivery:{job_id}')
+        return json.loads(job) if job else None
+
+    async def _notify(self, job: dict, e: BaseException) -> None:
+        if job['user_id'] is None:
+            return
+        reason = FAILURE_REASONS.get(type(e), 'something went wrong, try again later')
+        what = 'chart' if job['kind'] == 'chart' else 'forecast'
+        try:
+            await send_message(chat_id=job['user_id'], text=f'Sorry, your {what} was not delivered: {reason}')
+        except Exception as exc:
+            logger.warning(f"Job {job['job_id']}: user {job['user_id']} is not notified: {exc!r}")
+
+    async def _run(self, job: dict, func: Callable[..., Awaitable], kwargs: dict) -> None:
+        job['status'] = 'running'
+        await self._save(job)
+        try:
+            with histogram(f"delivery_{job['kind']}_seconds").time():
+                job['result'] = await func(**kwargs)
+            job['status'] = 'finished'
+        except (asyncio.CancelledError, KeyboardInterrupt, SystemExit):
+            raise
+        # custom exceptions of the app derive from BaseException
+        except BaseException as e:
+            logger.warning(f"Job {job['job_id']} ({job['kind']}) failed: {e!r}")
+            job['error'] = repr(e)
+            job['status'] = 'failed'
+            await self._notify(job, e)
+        finally:
+            job['finished_at'] = time.time()
+            await asyncio.shield(self._save(job))
+
+    async def _worker(self) -> None:
+        while True:
+            job, func, kwargs, queued_at = await self._queue.get()
+            self.queue_depth.dec()
+            histogram(f"delivery_{job['kind']}_wait_seconds").observe(time.perf_counter() - queued_at)
+            try:
+                await self._run(job, func, kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Job {job['job_id']} state is not saved: {e!r}")
+            finally:
+                self._queue.task_done()
+
+
+delivery_queue = DeliveryQueue()
@@ -10,4 +10,9 @@ class PairNotInUserList(BaseException): ...
 class ModelDoesNotExist(BaseException): ...
 class MlflowClientError(BaseException): ...
 class MlflowServerError(BaseException): ...
-class ModelURINotFound(BaseException): ...
\ No newline at end of file
+class ModelURINotFound(BaseException): ...
+class RenderQueueIsFull(BaseException): ...
+class StorageChatNotConfigured(BaseException): ...
+class DeliveryQueueIsFull(BaseException): ...
+class PicNotSent(BaseException): ...
+class CoinGeckoError(BaseException): ...
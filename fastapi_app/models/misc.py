@@ -1,5 +1,8 @@
 from contextlib import asynccontextmanager
-import time
+import io
+import asyncio
+import logging
+import random
 import aiohttp
 import aioredis
 from pydantic import BaseModel
@@ -7,11 +10,16 @@ from typing import List
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-from config import REDIS
+from PIL import Image
+from config import (REDIS, TOKEN, CHART_FORMAT, CHART_QUALITY, CHART_PNG_COLORS,
+                    TELEGRAM_RETRIES, TELEGRAM_RETRY_BACKOFF)
+from .upstream import http_clients
 
 
 sns.set_theme(style="darkgrid")
 
+logger = logging.getLogger(__name__)
+
 
 class UserResponse(BaseModel):
     _id: str
@@ -30,7 +38,44 @@ def validate_user_data(input_data):
     return valid.dict()
 
 
-async def send_pic(url: int, file_name: str | None = None, params: dict | None = None) -> dict:
+async def telegram_request(url: str, params: dict | None = None, photo: bytes | None = None) -> dict:
+    '''POST to Telegram Bot API and return its JSON response.
+
+    429 and 5xx responses are retried TELEGRAM_RETRIES times, and so are
+    connection errors raised before the request went out. A timed-out
+    or dropped request may already be delivered, so it is never repeated.
+    On 429 Telegram tells how long to wait in "parameters.retry_after",
+    otherwise backoff is exponential with jitter. Multipart form data
+    can not be sent twice, so it is rebuilt for every attempt.'''
+
+    for attempt in range(TELEGRAM_RETRIES + 1):
+        data = None
+        if photo:
+            data = aiohttp.FormData()
+            data.add_field('photo', photo, filename=f'chart.{CHART_FORMAT}', content_type=f'image/{CHART_FORMAT}')
+
+        delay = TELEGRAM_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+        try:
+            async with http_clients.request('telegram', 'POST', url=url, params=params, data=data, retries=0) as resp:
+                status = resp.status
+                try:
+                    response = await resp.json(content_type=None)
+                except ValueError:
+                    response = {'ok': False, 'description': await resp.text()}
+        # the connection was not established, nothing is sent
+        except aiohttp.ClientConnectorError as e:
+            if attempt == TELEGRAM_RETRIES:
+                raise
+            logger.warning(f'Telegram request failed ({e!r}), retry {attempt + 1}/{TELEGRAM_RETRIES}')
+        else:
+            if (status != 429 and status < 500) or attempt == TELEGRAM_RETRIES:
+                return response
+            delay = response.get('parameters', {}).get('retry_after', delay)
+            logger.warning(f'Telegram status {status}, retry {attempt + 1}/{TELEGRAM_RETRIES} in {delay} seconds')
+        await asyncio.sleep(delay)
+
+
+async def send_pic(url: int, photo: bytes | None = None, params: dict | None = None) -> dict:
     '''Send pic to user by POST HTTP-request to Telegram API.
 
     Return a JSON with response from Telegram server.
@@ -38,26 +83,46 @@ async def send_pic(url: int, file_name: str | None = None, params: dict | None =
     Parameters
     ----------
 
-    filename:
-        format {user_id}-{int(time.time())}.jpeg
+    photo:
+        rendered image, uploaded as multipart form data
     url:
-        format https://api.telegram.org/bot{TOKEN}/sendPhoto?chat_id={user_id}'''
-
-    if file_name:
-        with open(file_name, 'rb') as img:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url=url, data={'photo': img}) as resp:
-                    response = await resp.json()
-                    return response
+        format https://api.telegram.org/bot{TOKEN}/sendPhoto?chat_id={user_id}
+    params:
+        used when photo is None, format {'chat_id': 2741715718, 'photo': file_id}'''
+
+    return await telegram_request(url=url, params=params, photo=photo)
+
+
+async def send_message(chat_id: int, text: str) -> dict:
+    '''Send text message to user by Telegram API.'''
+
+    return await telegram_request(
+        url=f'https://api.telegram.org/bot{TOKEN}/sendMessage',
+        params={'chat_id': chat_id, 'text': text}
+    )
+
+
+def figure_to_bytes(fig) -> bytes:
+    '''Encode a figure to CHART_FORMAT in memory.
+
+    PNG is reduced to a CHART_PNG_COLORS palette (0 keeps full color),
+    JPEG and WebP use CHART_QUALITY.'''
+
+    buf = io.BytesIO()
+    if CHART_FORMAT == 'png' and CHART_PNG_COLORS:
+        fig.savefig(buf, format='png')
+        image = Image.open(buf).convert('RGB').quantize(colors=CHART_PNG_COLORS)
+        buf = io.BytesIO()
+        image.save(buf, format='png', optimize=True)
+    elif CHART_FORMAT in ('jpeg', 'webp'):
+        fig.savefig(buf, format=CHART_FORMAT, pil_kwargs={'quality': CHART_QUALITY})
     else:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=url, params=params) as resp:
-                response = await resp.json()
-                return response
+        fig.savefig(buf, format=CHART_FORMAT)
+    return buf.getvalue()
 
 
-def make_pic(prices: list, pair: str, user_id: int, day: int):
-    '''Make a pic with data prices. Return a file name.
+def make_pic(prices: list, pair: str, day: int) -> bytes:
+    '''Make a pic with data prices. Return an encoded image.
 
     Parameters
     ----------
@@ -66,8 +131,6 @@ def make_pic(prices: list, pair: str, user_id: int, day: int):
         format [[1680724852129, 28276.702324588], ...]
     pair:
         format 'bitcoin-usd'
-    user_id:
-        format 2741715718
     day:
         format 7'''
 
@@ -82,48 +145,46 @@ def make_pic(prices: list, pair: str, user_id: int, day: int):
         xlabel=f'last {day} days'
     )
     fig = plot.get_figure()
-    file_name = f'{user_id}-{int(time.time())}.jpeg'
-    fig.savefig(file_name)
+    photo = figure_to_bytes(fig)
 
-    plt.clf()
-    return file_name
+    plt.close(fig)
+    return photo
 
 
 def make_forecast_pic(
         prices: list,
-        forecast: str,
-        user_id: int,
+        forecast: pd.DataFrame,
         pair: str,
-        day_before: int = 12) -> str:
-    '''Makes a pic with forecast data.
+        day_before: int = 12) -> bytes:
+    '''Makes a pic with forecast data. Return an encoded image.
 
-    Return a file name (format: '{user_id}-{int(time.time())}.jpeg').'''
+    Parameters
+    ----------
+    forecast:
+        columns ds (datetime), yhat, yhat_lower, yhat_upper'''
 
     df = pd.DataFrame(prices, columns=['ds', 'y'])
     df.ds = pd.to_datetime(df.ds // 1000, unit='s')
 
-    forecast = pd.read_json(forecast)
-    forecast.ds = pd.to_datetime(forecast.ds // 1000, unit='s')
-
-    treshold = -(24 * day_before)
+    # slice by time, not by count: the points are not always on an hourly grid
+    recent = df[df.ds > df.ds.iloc[-1] - pd.Timedelta(days=day_before)]
     target_list = ['yhat_upper', 'yhat_lower', 'yhat']
 
     plt.figure(figsize=(17, 8), dpi=80)
-    plot = sns.lineplot(data=df, x=df.ds[treshold:], y=df.y[treshold:], label='data')
+    plot = sns.lineplot(data=recent, x=recent.ds, y=recent.y, label='data')
     for target in target_list:
         diff = df.y.iloc[-1] - forecast[target].iloc[0]
         sns.lineplot(data=forecast, x=forecast.ds, y=forecast[target] + diff, label=target)
-    plot.set(xlabel=f'Last {-treshold//24} days', ylabel='Closing Price')
+    plot.set(xlabel=f'Last {day_before} days', ylabel='Closing Price')
     plot.set_title(pair)
     plot.legend(loc=0)
 
     fig = plot.get_figure()
-    file_name = f'{user_id}-{int(time.time())}.jpeg'
-    fig.savefig(file_name)
+    photo = figure_to_bytes(fig)
 
-    plt.clf()
+    plt.close(fig)
 
-    return file_name
+    return photo
 
 
 @asynccontextmanager
@@ -0,0 +1,87 @@
+__all__ = [
+    'RenderPool',
+    'render_pool'
+]
+
+
+import asyncio
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable
+from config import RENDER_WORKERS, RENDER_MAX_QUEUE
+from metrics import histogram, gauge
+from .exc import RenderQueueIsFull
+
+
+def _init_worker() -> None:
+    '''Import plotting stack once per worker process and set the theme.'''
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import seaborn as sns
+    from . import misc  # noqa: F401
+    sns.set_theme(style="darkgrid")
+
+
+def _warm(delay: float = 0.1) -> int:
+    '''Keep a worker busy for a moment, so every worker gets started.'''
+
+    time.sleep(delay)
+    return multiprocessing.current_process().pid
+
+
+class RenderPool:
+    '''Bounded process pool for chart rendering.
+
+    Keeps pandas/matplotlib work out of the event loop.
+    If more than {max_queue} renders are pending, RenderQueueIsFull is raised.'''
+
+    def __init__(self, workers: int = RENDER_WORKERS, max_queue: int = RENDER_MAX_QUEUE) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: ProcessPoolExecutor | None = None
+        self.queue_depth = gauge('render_queue_depth')
+        self.rejected = gauge('render_rejected')
+        self.render_time = histogram('render_seconds')
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # "spawn" instead of "fork": the parent runs an event loop and motor threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+        return self._executor
+
+    async def start(self) -> None:
+        '''Start all workers and wait until they imported the plotting stack.'''
+
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*[loop.run_in_executor(executor, _warm) for _ in range(self.workers)])
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, func: Callable, **kwargs):
+        '''Run {func} with {kwargs} in a worker process and return its result.'''
+
+        if self.queue_depth.value >= self.max_queue:
+            self.rejected.inc()
+            raise RenderQueueIsFull()
+
+        loop = asyncio.get_running_loop()
+        self.queue_depth.inc()
+        try:
+            with self.render_time.time():
+                return await loop.run_in_executor(self._get_executor(), partial(func, **kwargs))
+        finally:
+            self.queue_depth.dec()
+
+
+render_pool = RenderPool()
@@ -6,25 +6,122 @@ __all__ = [
 ]
 
 
-import aiohttp
-import time
-import os
+import io
+import json
+import asyncio
 import logging
+import pandas as pd
+from functools import partial
+from typing import Awaitable, Callable
+from datetime import datetime, timezone
 from .misc import redis_aio, send_pic, make_pic, make_forecast_pic
-from mongodb import unit_of_work
+from mongodb import unit_of_work, PRICES, hour_start, price_documents, refresh_range, to_milliseconds
 from .models import Pair, User
-from pymongo import DESCENDING
-from config import TOKEN, MLFLOW_CLIENT, MLFLOW_SERVER
+from .coins import coin_cache
+from .render import render_pool
+from .upstream import http_clients
+from .columnar import COLUMNAR_MEDIA_TYPE, encode_frame, decode_frame
+from .singleflight import chart_flight
+from metrics import histogram
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+from aioredis.exceptions import LockError
+from config import (TOKEN, MLFLOW_CLIENT, MLFLOW_SERVER, FORECAST_CACHE_TTL, MODEL_URI_TTL,
+                    CHART_CACHE_TTL, CHART_LOCK_TIMEOUT, STORAGE_CHAT, CHART_WARM_TOP, RENDER_WORKERS)
 from .exc import (UserNotFound, UserAlreadyExist, UserUpdateError,
                   UserCreationError, VsCurrencyIncorrect, CoinIdIncorrect,
                   PairListIsOver, PairNotInDataBase, PairNotInUserList,
-                  MlflowClientError, MlflowServerError, ModelURINotFound)
+                  MlflowClientError, MlflowServerError, ModelURINotFound,
+                  StorageChatNotConfigured, PicNotSent, CoinGeckoError)
 
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
+FORECAST_COLUMNS = ['ds', 'yhat', 'yhat_lower', 'yhat_upper']
+
+USER_FIELDS = ['user_id', 'user_name', 'n_pairs', 'pairs']
+
+# sorted set of "{pair} {day}" scored by number of requests
+POPULAR_CHARTS = 'charts:popular'
+
+
+def _chart_key(pair: str, day: int, version: int, run_id: str | None = None) -> str:
+    '''Redis key of chart file_id.
+
+    {version} is "last_ts" of pair: it only grows when new points are stored,
+    so a key never outlives its data. Forecast charts also carry {run_id}.'''
+
+    if run_id is None:
+        return f'chart:{pair}:{day}:{version}'
+    return f'chart:{pair}:forecast:{day}:{version}:{run_id}'
+
+
+async def _upload_chart(key: str, url: str, render: Callable[[], Awaitable[bytes]]) -> tuple[str, dict | None]:
+    '''Render chart {key}, upload it by {url} and cache its "file_id".
+
+    Concurrent calls of a key in this process share one upload (chart_flight),
+    other workers wait on Redis lock "lock:{key}" and take the cached "file_id".
+    If the shared upload fails, e.g. the leader blocked the bot, waiters upload
+    for themselves. If the lock is not taken in CHART_LOCK_TIMEOUT, the chart
+    is rendered without it. Raise PicNotSent if Telegram rejects the upload.
+    Return ("file_id", Telegram response), response is None if this call did not upload.'''
+
+    async def put(redis) -> tuple[str, dict]:
+        response = await send_pic(url=url, photo=await render())
+        if not response.get('ok'):
+            raise PicNotSent(response.get('description'))
+        file_id = response['result']['photo'][-1]['file_id']
+        await redis.set(name=key, value=file_id, ex=CHART_CACHE_TTL)
+        return file_id, response
+
+    async def upload() -> tuple[str, dict | None]:
+        async with redis_aio() as redis:
+            lock = redis.lock(f'lock:{key}', timeout=CHART_LOCK_TIMEOUT, blocking_timeout=CHART_LOCK_TIMEOUT)
+            if not await lock.acquire():
+                logger.warning(f'Chart {key}: lock is not taken in {CHART_LOCK_TIMEOUT} seconds, render without it')
+                return await put(redis)
+            try:
+                value = await redis.get(key)
+                if value:
+                    return value.decode('utf-8'), None
+                return await put(redis)
+            finally:
+                try:
+                    await lock.release()
+                except LockError:
+                    # expired while rendering, it may belong to another worker now
+                    pass
+
+    (file_id, response), leader = await chart_flight.do(key, upload, share_errors=False)
+    return file_id, response if leader else None
+
+
+async def _send_chart(key: str, user_id: int, render: Callable[[], Awaitable[bytes]]) -> dict:
+    '''Send chart {key} to user. Forward the cached "file_id",
+    or render and upload the chart once. Return Telegram response.'''
+
+    async with redis_aio() as redis:
+        value = await redis.get(key)
+
+    if value:
+        file_id, response = value.decode('utf-8'), None
+    else:
+        file_id, response = await _upload_chart(
+            key,
+            url=f'https://api.telegram.org/bot{TOKEN}/sendPhoto?chat_id={user_id}',
+            render=render
+        )
+
+    if response is None:
+        response = await send_pic(
+            url=f'https://api.telegram.org/bot{TOKEN}/sendPhoto',
+            params={'chat_id': int(user_id), 'photo': file_id}
+        )
+    return response
+
+
 class Other:
     '''Class for coins and currencies aggregation.
     It has two static methods: for update and validation pair.'''
@@ -46,100 +143,110 @@ class Other:
 
         responses = []
 
-        async with aiohttp.ClientSession() as session:
-
-            for title, url in data.items():
-                async with session.get(url, headers=headers) as resp:
-                    responses.append(
-                        {
-                            'name': title,
-                            'data': await resp.json()
-                        }
-                    )
+        for title, url in data.items():
+            async with http_clients.request('coingecko', 'GET', url, headers=headers) as resp:
+                responses.append(
+                    {
+                        'name': title,
+                        'data': await resp.json()
+                    }
+                )
 
         for el in responses:
-            async with unit_of_work('other') as uow:
+            async with unit_of_work('other', mode='write') as uow:
                 resp = await uow.read({'name': el['name']})
                 if resp:
-                    await uow.update({"$set": {'data': el}})
+                    await uow.update({"$set": {'data': el['data']}})
                 else:
                     await uow.create(el)
 
+        await coin_cache.invalidate()
+
     @staticmethod
     async def _pair_existence(pair: Pair) -> dict:
-        '''Check if pair exist. Returns status code.
+        '''Check if pair exist by in-memory coin cache. Returns status code.
 
         :return: 432 - Wrong vs_currency.
         :return: 433 - Wrong coin.
         :return: 200 - Everything is correct.'''
 
-        async with unit_of_work('other') as uow:
-            vs_currency = await uow.find_id({
-                'name': 'supported_vs_currencies',
-                'data': {
-                    '$in': [pair.vs_currency]
-                }
-            })
-            coin_id = await uow.find_id({
-                'name': 'coins_list',
-                'data': {
-                    '$elemMatch': {'id': pair.coin_id}
-                }
-            })
+        if not coin_cache.loaded:
+            await coin_cache.load()
+
+        vs_currency = pair.vs_currency in coin_cache.vs_currencies
+        coin_id = pair.coin_id in coin_cache.coin_ids
 
-        if vs_currency is None:
+        if not vs_currency:
             raise VsCurrencyIncorrect()
 
-        if coin_id is None:
+        if not coin_id:
             raise CoinIdIncorrect()
 
         return {'code': 200, 'detail': 'pair is valid'}
 
     @staticmethod
     async def pair_in_database(coin_id: str, vs_currency: str, day: int = 7) -> dict | None:
-        '''Return pair data if it exists.
-        Otherwise return None'''
-
-        time_slice = -(day * 24)
-
-        async with unit_of_work('pairs') as uow:
-            query = {'pair_name': f'{coin_id}-{vs_currency}'}
-            projection = {
-                'data': {
-                    'prices': {'$slice': time_slice},
-                    'market_caps': 0,
-                    'total_volumes': 0
-                }
-            }
-            return await uow.find_id(query=query, projection=projection)
+        '''Return pair data for the last {day} days if it exists.
+        Otherwise return None. Read only, no session is opened.
+
+        Format:
+        {
+            "pair_name": "bitcoin-usd",
+            "last_ts": 1680724852129,
+            "prices": [[1680724852129, 28276.702324588], ...]
+        }'''
+
+        pair_name = f'{coin_id}-{vs_currency}'
+
+        async with unit_of_work('pairs', mode='read') as uow:
+            pair = await uow.find_id({'pair_name': pair_name}, {'_id': 0, 'pair_name': 1, 'last_ts': 1})
+
+        if pair is None or pair.get('last_ts') is None:
+            return None
+
+        since = datetime.fromtimestamp(pair['last_ts'] / 1000 - day * 24 * 60 * 60, tz=timezone.utc)
+
+        async with unit_of_work(PRICES, mode='read') as uow:
+            cur = uow.collection.find(
+                {'pair_name': pair_name, 'ts': {'$gt': since}},
+                {'_id': 0, 'ts': 1, 'price': 1}
+            ).sort('ts', ASCENDING)
+            pair['prices'] = [[to_milliseconds(el['ts']), el['price']] async for el in cur]
+
+        return pair
 
     @staticmethod
     async def checker(user_id: int, coin_id: str, vs_currency: str, day: int) -> dict | None:
         '''Check if user exist, pair exist in user's list and database.
 
         If all is "True" return pair data.
-        Otherwise, returns None.'''
+        Otherwise, returns None.
 
-        pair = f'{coin_id}-{vs_currency}'
+        The user and the pair data are read concurrently without a session.
+        The user read only returns {pair} if it is in the user's list.'''
 
-        async with unit_of_work('users') as uow:
-            user = await uow.read({'user_id': user_id})
+        pair = f'{coin_id}-{vs_currency}'
 
-        if user:
-            if pair in user['pairs']:
-                pair_in_db = await Other.pair_in_database(
+        async with unit_of_work('users', mode='read') as uow:
+            user, pair_in_db = await asyncio.gather(
+                uow.find_id(
+                    {'user_id': user_id},
+                    {'_id': 0, 'pairs': {'$elemMatch': {'$eq': pair}}}
+                ),
+                Other.pair_in_database(
                     coin_id=coin_id,
                     vs_currency=vs_currency,
                     day=day
                 )
-                if pair_in_db:
-                    return pair_in_db
-                else:
-                    raise PairNotInDataBase()
-            else:
-                raise PairNotInUserList()
-        else:
+            )
+
+        if user is None:
             raise UserNotFound()
+        if not user.get('pairs'):
+            raise PairNotInUserList()
+        if not pair_in_db:
+            raise PairNotInDataBase()
+        return pair_in_db
 
 
 class Pairs:
@@ -151,8 +258,10 @@ class Pairs:
 
         pair_name = f'{pair.coin_id}-{pair.vs_currency}'
 
-        NOW = int(time.time())
-        THEN = NOW - 60 * 60 * 24 * 89
+        async with unit_of_work('pairs', mode='read') as uow:
+            pair_meta = await uow.find_id({'pair_name': pair_name}, {'_id': 0, 'last_ts': 1}) or {}
+
+        THEN, NOW = refresh_range(pair_meta.get('last_ts'))
 
         params = {
             'vs_currency': pair.vs_currency,
@@ -160,22 +269,39 @@ class Pairs:
             'to': NOW,
         }
 
-        async with aiohttp.ClientSession() as session:
+        async with http_clients.request(
+                'coingecko',
+                'GET',
+                f'https://api.coingecko.com/api/v3/coins/{pair.coin_id}/market_chart/range',
+                params=params,
+                headers={'accept': 'application/json'}) as resp:
+            # rate limited after retries, or {"error": "coin not found"}
+            if resp.status != 200:
+                raise CoinGeckoError(f'{pair_name}: {resp.status} {await resp.text()}')
+            data = await resp.json()
+            if 'prices' not in data:
+                raise CoinGeckoError(f'{pair_name}: {data}')
+
+        docs = price_documents(
+            pair_name=pair_name,
+            data=data,
+            after=pair_meta.get('last_ts'),
+            before=hour_start()
+        )
 
-            async with session.get(
-                    f'https://api.coingecko.com/api/v3/coins/{pair.coin_id}/market_chart/range',
-                    params=params,
-                    headers={'accept': 'application/json'}) as resp:
-                data = await resp.json()
+        if not docs:
+            return True
 
-        async with unit_of_work('pairs') as uow:
-            if await uow.read({'pair_name': pair_name}, {'_id': 1}):
-                return await uow.update({'$set': {'data': data}})
-            else:
-                return await uow.create({
-                    'pair_name': pair_name,
-                    'data': data
-                })
+        # time-series collections can not be written in a transaction
+        async with unit_of_work(PRICES, mode='write') as uow:
+            await uow.create_many(docs)
+
+        async with unit_of_work('pairs', mode='write') as uow:
+            return await uow.update(
+                query={'$set': {'last_ts': to_milliseconds(docs[-1]['ts'])}},
+                filter_={'pair_name': pair_name},
+                upsert=True
+            )
 
     # ONLY FOR MLFLOW CLIENT
     @staticmethod
@@ -187,19 +313,20 @@ class Pairs:
 
         result = await Other.pair_in_database(coin_id=coin_id, vs_currency=vs_currency, day=day)
         if result:
-            return result['data']['prices']
+            return result['prices']
         else:
             raise PairNotInDataBase()
 
     @staticmethod
-    async def get_pic(user_id: int, coin_id: str, vs_currency: str, day: int = 7):
+    async def get_pic(user_id: int, coin_id: str, vs_currency: str, day: int = 7, pair_data: dict | None = None):
         '''Send pic to user.
 
         Do a POST HTTP-request to Telegram server.
         If any user makes a request it create a pic with data exchanges
-        then cache "file_id" and request for 10 min.
+        then cache "file_id" until new data of pair is stored.
         If cache is empty or key is does not exist,
-        it creates a new picture.
+        it creates a new picture. Every request counts in POPULAR_CHARTS.
+        {pair_data} of Other.checker skips the check when it is done already.
 
         :return: 200 - JSON response
         :return: 433 - pair is incorrect
@@ -207,46 +334,84 @@ class Pairs:
         :return: 437 - pair not found in user's list.'''
 
         pair = f'{coin_id}-{vs_currency}'
-        pair_data = await Other.checker(
-            user_id=user_id,
-            coin_id=coin_id,
-            vs_currency=vs_currency,
-            day=day)
+        if pair_data is None:
+            pair_data = await Other.checker(
+                user_id=user_id,
+                coin_id=coin_id,
+                vs_currency=vs_currency,
+                day=day)
+
+        key = _chart_key(pair, day, pair_data['last_ts'])
 
-        # check if exist in cache
         async with redis_aio() as redis:
-            value = await redis.get(f'{pair} {day}')
-            if value:
-                value: bytes
-                url = f'https://api.telegram.org/bot{TOKEN}/sendPhoto'
-                params = {
-                    'chat_id': int(user_id),
-                    'photo': value.decode("utf-8")
-                }
-                resp = await send_pic(url=url, params=params)
-                return {'code': 200, 'detail': resp}
+            await redis.zincrby(POPULAR_CHARTS, 1, f'{pair} {day}')
 
-        file_name = make_pic(
-            prices=pair_data['data']['prices'],
-            pair=pair,
-            user_id=user_id,
-            day=day
-        )
+        with histogram('delivery_chart_send_seconds').time():
+            response = await _send_chart(
+                key,
+                user_id=user_id,
+                render=partial(render_pool.render, make_pic, prices=pair_data['prices'], pair=pair, day=day)
+            )
+        return {'code': 200, 'detail': response}
 
-        response = await send_pic(
-            url=f'https://api.telegram.org/bot{TOKEN}/sendPhoto?chat_id={user_id}',
-            file_name=file_name
-        )
-        os.remove(file_name)
+    @staticmethod
+    async def _warm_chart(name: str, semaphore: asyncio.Semaphore) -> str:
+        '''Render chart "{pair} {day}" and upload it to STORAGE_CHAT
+        unless it is cached for the current data. Return the outcome.'''
 
-        async with redis_aio() as redis:
-            await redis.set(
-                name=f'{pair} {day}',
-                value=response['result']['photo'][-1]['file_id'],
-                ex=600
+        pair, day = name.split(' ')
+        coin_id, vs_currency = pair.rsplit('-', 1)
+
+        async with semaphore:
+            pair_data = await Other.pair_in_database(coin_id=coin_id, vs_currency=vs_currency, day=int(day))
+            if pair_data is None:
+                return 'failed'
+
+            key = _chart_key(pair, day, pair_data['last_ts'])
+            async with redis_aio() as redis:
+                if await redis.exists(key):
+                    return 'cached'
+
+            _, response = await _upload_chart(
+                key,
+                url=f'https://api.telegram.org/bot{TOKEN}/sendPhoto?chat_id={STORAGE_CHAT}&disable_notification=true',
+                render=partial(render_pool.render, make_pic, prices=pair_data['prices'], pair=pair, day=int(day))
             )
+        return 'cached' if response is None else 'warmed'
+
+    @staticmethod
+    async def warm_charts(top: int = CHART_WARM_TOP) -> dict:
+        '''Pre-render the {top} most requested charts after a data refresh.
+
+        Charts are uploaded once to STORAGE_CHAT, so get_pic only forwards
+        their "file_id". Popularity halves on every warm-up to follow demand.
+
+        Format:
+        {"warmed": ["bitcoin-usd 7"], "cached": [...], "failed": [...]}'''
+
+        if not STORAGE_CHAT:
+            raise StorageChatNotConfigured()
+
+        async with redis_aio() as redis:
+            popular = [el.decode('utf-8') for el in await redis.zrevrange(POPULAR_CHARTS, 0, top - 1)]
+            await redis.zunionstore(POPULAR_CHARTS, {POPULAR_CHARTS: 0.5})
+            await redis.zremrangebyscore(POPULAR_CHARTS, 0, 0.1)
+
+        semaphore = asyncio.Semaphore(RENDER_WORKERS)
+        results = await asyncio.gather(
+            *[Pairs._warm_chart(name, semaphore) for name in popular],
+            return_exceptions=True
+        )
 
-        return True
+        summary = {'warmed': [], 'cached': [], 'failed': []}
+        for name, res in zip(popular, results):
+            if isinstance(res, BaseException):
+                logger.warning(f'Chart {name} warm-up failed: {res!r}')
+                res = 'failed'
+            summary[res].append(name)
+        logger.info(f"Charts warmed: {len(summary['warmed'])}, cached: {len(summary['cached'])}, "
+                    f"failed: {len(summary['failed'])}")
+        return summary
 
     @staticmethod
     async def delete_pair(pair: Pair):
@@ -263,7 +428,7 @@ class Users:
         :return: True - user successfully created
         :return: None - user alredy exists.'''
 
-        async with unit_of_work('users') as uow:
+        async with unit_of_work('users', mode='write') as uow:
             if await uow.find_id({'user_id': user.user_id}) is None:
                 user_data = {
                     'user_id': user.user_id,
@@ -271,7 +436,12 @@ class Users:
                     'n_pairs': user.n_pairs,
                     'pairs': []
                 }
-                if await uow.create(query=user_data):
+                try:
+                    created = await uow.create(query=user_data)
+                except DuplicateKeyError:
+                    # created concurrently, "user_id" is unique
+                    raise UserAlreadyExist()
+                if created:
                     return True
                 else:
                     raise UserCreationError()
@@ -279,19 +449,49 @@ class Users:
                 raise UserAlreadyExist()
 
     @staticmethod
-    async def get_all_users():
-        '''Return all users data'''
+    async def iter_users(after: int | None = None, fields: list[str] | None = None, limit: int | None = None):
+        '''Yield users as the cursor fetches them, greater "user_id" first.
+
+        after:
+            keyset cursor, only users with a smaller "user_id" are returned
+        fields:
+            fields of USER_FIELDS to return, "user_id" is always included'''
+
+        query = {} if after is None else {'user_id': {'$lt': after}}
+        projection = {'_id': 0, 'user_id': 1, **{el: 1 for el in (fields or USER_FIELDS)}}
+
+        async with unit_of_work('users', mode='read') as uow:
+            cur = uow.collection.find(query, projection).sort('user_id', DESCENDING)
+            if limit:
+                cur = cur.limit(limit)
+            async for doc in cur:
+                yield doc
+
+    @staticmethod
+    async def get_all_users(limit: int = 100, after: int | None = None, fields: list[str] | None = None) -> dict:
+        '''Return a page of users data, greater "user_id" first.
 
-        async with unit_of_work('users') as uow:
-            cur = uow.collection.find({}, {'_id': 0}).sort('user_id', DESCENDING)
-            docs = await cur.to_list(None)
-            return docs
+        Pass "next" as {after} to get the next page, it is None on the last one.
+
+        Format:
+        {
+            "data": [{"user_id": 37317, "user_name": "kegga", "n_pairs": 3, "pairs": []}],
+            "next": 37317 | None
+        }'''
+
+        # one more user than the page tells whether there is a next page
+        docs = [doc async for doc in Users.iter_users(after=after, fields=fields, limit=limit + 1)]
+        page = docs[:limit]
+        return {
+            'data': page,
+            'next': page[-1]['user_id'] if len(docs) > limit else None
+        }
 
     @staticmethod
     async def get_user(user_id: int) -> dict:
         '''Get user data by user_id'''
 
-        async with unit_of_work('users') as uow:
+        async with unit_of_work('users', mode='read') as uow:
             user = await uow.find_id({'user_id': user_id}, {'_id': 0})
         if user:
             return user
@@ -302,7 +502,7 @@ class Users:
     async def set_n_pairs(user_id: int, n_pairs: int = 3) -> bool:
         '''Set count of available pair fot selected user (user_id)'''
 
-        async with unit_of_work('users') as uow:
+        async with unit_of_work('users', mode='write') as uow:
             res = await uow.update(
                 query={'$set': {'n_pairs': n_pairs}},
                 filter_={'user_id': user_id}
@@ -318,7 +518,7 @@ class Users:
 
         await Other._pair_existence(pair=pair)
 
-        async with unit_of_work('users') as uow:
+        async with unit_of_work('users', mode='write') as uow:
             user = await uow.read({'user_id': user_id})
             if user:
                 if user['n_pairs'] > len(user['pairs']):
@@ -338,7 +538,7 @@ class Users:
     async def delete_users_pair(user_id: int, pair: str):
         '''Delete pair from pair list'''
 
-        async with unit_of_work('users') as uow:
+        async with unit_of_work('users', mode='write') as uow:
             if await uow.update(
                 query={'$pull': {'pairs': pair}},
                 filter_={'user_id': user_id}
@@ -351,7 +551,7 @@ class Users:
     async def delete_user(user_id: int):
         '''Delete user by user_id'''
 
-        async with unit_of_work('users') as uow:
+        async with unit_of_work('users', mode='write') as uow:
             if await uow.delete({'user_id': user_id}):
                 return True
             else:
@@ -362,94 +562,162 @@ class Models:
 
     @staticmethod
     async def create_run_by_pair(coin_id: str, vs_currency: str) -> dict | None:
-        '''Send request to mlflow client to do run.'''
-        async with aiohttp.ClientSession() as session:
-            url = f'http://{MLFLOW_CLIENT}:80/prophet/do_run'
-            params = {
-                'coin_id': coin_id,
-                'vs_currency': vs_currency
-            }
-            async with session.post(url=url,
-                                    params=params) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    raise MlflowClientError('Run failed')
+        '''Send request to mlflow client to queue a run.
+
+        Mlflow client runs one job per pair, repeated calls return the same job.'''
+        url = f'http://{MLFLOW_CLIENT}:80/prophet/do_run'
+        params = {
+            'coin_id': coin_id,
+            'vs_currency': vs_currency
+        }
+        async with http_clients.request('mlflow_client', 'POST', url=url, params=params, retries=0) as resp:
+            if resp.status == 202:
+                return await resp.json()
+            else:
+                raise MlflowClientError('Run failed')
+
+    @staticmethod
+    async def register_model(pair: str, run_id: str, last_data: str) -> bool:
+        '''Save the latest finished run of pair to the local registry.
+
+        Called by mlflow client when /prophet/do_run finishes.'''
+
+        async with redis_aio() as redis:
+            return await redis.set(
+                name=f'model:{pair}',
+                value=json.dumps({'run_id': run_id, 'last_data': last_data})
+            )
 
     @staticmethod
     async def get_model_uri(pair: str, model: str = 'prophet-model') -> dict | None:
         '''Class method return a dict with model_uri and last_day.
 
-        If any exception raise then return None.
+        The latest run is read from the local registry "model:{pair}".
+        On a miss Mlflow server is asked for the latest finished run,
+        the answer is kept for MODEL_URI_TTL seconds.
         Format:
         {
             "model_uri": "runs:/844793cfeeb44e01b9f27b8ca15b015e/prophet-model",
-            "last_day": "2023-04-12 20:00:30"
+            "last_data": "2023-04-12 20:00:30"
         }'''
 
-        async with aiohttp.ClientSession() as session:
-
-            url_get = f'http://{MLFLOW_SERVER}:5000/api/2.0/mlflow/experiments/get-by-name'
-            params = {'experiment_name': pair}
-
-            async with session.get(url_get,
-                                   params=params) as get_resp:
-                if get_resp.status == 200:
-                    res = await get_resp.json()
-                    exp_id = res['experiment']['experiment_id']
-                    url_post = f'http://{MLFLOW_SERVER}:5000/api/2.0/mlflow/runs/search'
-                    data = {'experiment_ids': [exp_id]}
-
-                    async with session.post(url_post,
-                                            json=data) as post_resp:
-                        if post_resp.status == 200:
-                            runs = await post_resp.json()
-                            run_uuid = runs['runs'][0]['info']['run_uuid']
-                            model_uri = f'runs:/{run_uuid}/{model}'
-                            last_data = [
-                                el['value'] for el in runs['runs'][0]['data']['params'] if el['key'] == 'last_day'
-                            ]
-                            return {
-                                'model_uri': model_uri,
-                                'last_data': last_data.pop()
-                            }
-                        else:
-                            raise ModelURINotFound('Model uri not found')
-                else:
-                    raise MlflowServerError('REST API error')
+        async with redis_aio() as redis:
+            value = await redis.get(f'model:{pair}')
+        if value:
+            latest = json.loads(value)
+            return {
+                'model_uri': f"runs:/{latest['run_id']}/{model}",
+                'last_data': latest['last_data']
+            }
+
+        url_get = f'http://{MLFLOW_SERVER}:5000/api/2.0/mlflow/experiments/get-by-name'
+        params = {'experiment_name': pair}
+
+        async with http_clients.request('mlflow_server', 'GET', url_get, params=params) as get_resp:
+            if get_resp.status == 200:
+                res = await get_resp.json()
+            else:
+                raise MlflowServerError('REST API error')
+
+        exp_id = res['experiment']['experiment_id']
+        url_post = f'http://{MLFLOW_SERVER}:5000/api/2.0/mlflow/runs/search'
+        data = {
+            'experiment_ids': [exp_id],
+            'filter': "attributes.status = 'FINISHED'",
+            'max_results': 1,
+            'order_by': ['attributes.start_time DESC']
+        }
+
+        async with http_clients.request('mlflow_server', 'POST', url_post, json=data) as post_resp:
+            if post_resp.status == 200:
+                runs = await post_resp.json()
+            else:
+                raise ModelURINotFound('Model uri not found')
+
+        if not runs.get('runs'):
+            raise ModelURINotFound('Model uri not found')
+
+        run_uuid = runs['runs'][0]['info']['run_uuid']
+        last_data = [
+            el['value'] for el in runs['runs'][0]['data']['params'] if el['key'] == 'last_day'
+        ]
+
+        async with redis_aio() as redis:
+            await redis.set(
+                name=f'model:{pair}',
+                value=json.dumps({'run_id': run_uuid, 'last_data': last_data[-1]}),
+                ex=MODEL_URI_TTL
+            )
+
+        return {
+            'model_uri': f'runs:/{run_uuid}/{model}',
+            'last_data': last_data.pop()
+        }
 
     @staticmethod
-    async def forecast(day: int, model_uri: str, last_data: str):
-        '''Forecast for day through Mlflow Client'''
+    async def forecast(day: int, model_uri: str, last_data: str, pair: str | None = None) -> pd.DataFrame:
+        '''Forecast for day through Mlflow Client.
+
+        Forecast of a run never changes, so it is cached in Redis hash
+        "forecast:{run_id}" (field is day) in a compact binary form.
+        When a new run of {pair} shows up, the old run's hash is deleted.'''
+
+        day = int(day)
+        run_id = model_uri.split('/')[1]
+        key = f'forecast:{run_id}'
+
+        async with redis_aio() as redis:
+            if pair:
+                previous = await redis.getset(f'forecast:latest:{pair}', run_id)
+                if previous and previous.decode('utf-8') != run_id:
+                    await redis.delete(f"forecast:{previous.decode('utf-8')}")
+            cached = await redis.hget(key, day)
+        if cached:
+            return decode_frame(cached)
 
         logger.info(f'params {day} {model_uri} {last_data}')
-        async with aiohttp.ClientSession() as session:
+        headers = {
+            'accept': f'{COLUMNAR_MEDIA_TYPE}, application/json;q=0.5',
+            'content-type': 'application/x-www-form-urlencoded',
+        }
 
-            headers = {
-                'accept': 'application/json',
-                'content-type': 'application/x-www-form-urlencoded',
-            }
+        params = {
+            'day': day,
+            'model_uri': model_uri,
+            'last_data': last_data,
+        }
 
-            params = {
-                'day': day,
-                'model_uri': model_uri,
-                'last_data': last_data,
-            }
+        async with http_clients.request(
+                'mlflow_client',
+                'POST',
+                f'http://{MLFLOW_CLIENT}/prophet/predict',
+                params=params,
+                headers=headers) as resp:
+            if resp.status != 200:
+                raise MlflowClientError('Predict failed')
+            if resp.content_type == COLUMNAR_MEDIA_TYPE:
+                preds = decode_frame(await resp.read())[FORECAST_COLUMNS]
+            else:
+                res = await resp.json()
+                preds = pd.read_json(io.StringIO(res['predictions']))[FORECAST_COLUMNS]
+                preds.ds = pd.to_datetime(preds.ds, unit='ms')
 
-            async with session.post(
-                    f'http://{MLFLOW_CLIENT}/prophet/predict',
-                    params=params,
-                    headers=headers) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    raise MlflowClientError('Predict failed')
+        async with redis_aio() as redis:
+            await redis.hset(key, day, encode_frame(preds))
+            await redis.expire(key, FORECAST_CACHE_TTL)
+
+        return preds
 
     @staticmethod
-    async def send_forecast_pic(user_id: int, pair: Pair, forecast: str, day_before: int = 12):
+    async def send_forecast_pic(user_id: int,
+                                pair: Pair,
+                                forecast: pd.DataFrame,
+                                model_uri: str,
+                                day_before: int = 12):
         '''Makes a picture with forecast for user.
 
-        Send it by Telegram Bot API.'''
+        Send it by Telegram Bot API. "file_id" is cached
+        until new data of pair is stored or a new run of {model_uri} shows up.'''
 
         pair_data = await Other.checker(
             user_id=user_id,
@@ -459,38 +727,37 @@ class Models:
         )
 
         if pair_data:
-            async with redis_aio() as redis:
-                pair_name = f'{pair.coin_id}-{pair.vs_currency}'
-                value = await redis.get(f'{pair_name} forecast for {day_before}')
-                if value:
-                    value: bytes
-                    url = f'https://api.telegram.org/bot{TOKEN}/sendPhoto'
-                    params = {
-                        'chat_id': int(user_id),
-                        'photo': value.decode("utf-8")
-                    }
-                    resp = await send_pic(url=url, params=params)
-                    return {'code': 200, 'detail': resp}
-
-            file_name = make_forecast_pic(
-                prices=pair_data['data']['prices'],
-                forecast=forecast,
-                user_id=user_id,
-                pair=f"{pair.coin_id}-{pair.vs_currency}",
-                day_before=day_before
-            )
+            pair_name = f'{pair.coin_id}-{pair.vs_currency}'
+            key = _chart_key(pair_name, day_before, pair_data['last_ts'], run_id=model_uri.split('/')[1])
+
+            with histogram('delivery_forecast_send_seconds').time():
+                response = await _send_chart(
+                    key,
+                    user_id=user_id,
+                    render=partial(
+                        render_pool.render,
+                        make_forecast_pic,
+                        prices=pair_data['prices'],
+                        forecast=forecast,
+                        pair=pair_name,
+                        day_before=day_before
+                    )
+                )
+            return {'code': 200, 'detail': response}
 
-            response = await send_pic(
-                url=f'https://api.telegram.org/bot{TOKEN}/sendPhoto?chat_id={user_id}',
-                file_name=file_name
-            )
-            os.remove(file_name)
+    @staticmethod
+    async def deliver_forecast(user_id: int, pair: Pair, day: int, model: dict) -> dict:
+        '''Forecast {day} by {model} of Models.get_model_uri and send the picture to user.
+        Runs as a delivery job.'''
 
-            async with redis_aio() as redis:
-                await redis.set(
-                    name=f'{pair.coin_id}-{pair.vs_currency} forecast for {day_before}',
-                    value=response['result']['photo'][-1]['file_id'],
-                    ex=600
-                )
+        pair_name = f'{pair.coin_id}-{pair.vs_currency}'
+        with histogram('delivery_forecast_predict_seconds').time():
+            forecast = await Models.forecast(day=day, pair=pair_name, **model)
 
-            return {'code': 200, 'detail': response}
+        return await Models.send_forecast_pic(
+            user_id=user_id,
+            pair=pair,
+            forecast=forecast,
+            model_uri=model['model_uri'],
+            day_before=day * 3
+        )
@@ -0,0 +1,54 @@
+__all__ = [
+    'SingleFlight',
+    'chart_flight'
+]
+
+
+import asyncio
+from typing import Awaitable, Callable
+
+
+class SingleFlight:
+    '''Coalesce concurrent calls with the same key in this process.
+
+    The first caller of a key runs {func}, callers that come while it is
+    in flight wait for the same result instead of running it again.
+    A cancelled waiter does not cancel the shared call.'''
+
+    def __init__(self) -> None:
+        self._calls: dict[str, asyncio.Task] = {}
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # mark exception as retrieved when every waiter is gone
+            task.exception()
+
+    async def do(self, key: str, func: Callable[[], Awaitable], share_errors: bool = True) -> tuple:
+        '''Return (result of {func}, True if this caller ran it).
+
+        Without {share_errors} a waiter does not inherit an error of the
+        shared call: it runs its own {func} instead, for errors which
+        depend on the caller (e.g. the leader's chat is not reachable).'''
+
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            task = self._calls[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda t: self._done(key, t))
+        try:
+            return await asyncio.shield(task), leader
+        except (asyncio.CancelledError, KeyboardInterrupt, SystemExit):
+            raise
+        # custom exceptions of the app derive from BaseException
+        except BaseException:
+            if leader or share_errors:
+                raise
+        return await func(), True
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+chart_flight = SingleFlight()
@@ -0,0 +1,134 @@
+__all__ = [
+    'Upstream',
+    'HttpClients',
+    'http_clients'
+]
+
+
+import asyncio
+import random
+import time
+import logging
+import aiohttp
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from config import (HTTP_POOL_LIMIT, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT,
+                    HTTP_RETRIES, HTTP_RETRY_BACKOFF)
+from metrics import histogram
+
+
+logger = logging.getLogger(__name__)
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass(frozen=True)
+class Upstream:
+    '''Connection settings of an outbound service.
+
+    timeout:
+        total seconds for one attempt
+    retries:
+        default number of retries after a failed attempt
+    retry_sent:
+        retry timeouts and dropped connections too, the request may
+        have reached the server already; off for non-idempotent sends'''
+
+    name: str
+    timeout: float
+    connect_timeout: float = 5
+    retries: int = HTTP_RETRIES
+    retry_sent: bool = True
+
+
+UPSTREAMS = {
+    'coingecko': Upstream(name='coingecko', timeout=30),
+    # sendPhoto/sendMessage must not be delivered twice
+    'telegram': Upstream(name='telegram', timeout=30, retry_sent=False),
+    'mlflow_server': Upstream(name='mlflow_server', timeout=10),
+    # predict may load a model, do_run fits it
+    'mlflow_client': Upstream(name='mlflow_client', timeout=600),
+}
+
+
+class HttpClients:
+    '''One keep-alive aiohttp session per upstream, owned by the app lifespan.'''
+
+    def __init__(self, upstreams: dict[str, Upstream] = UPSTREAMS) -> None:
+        self.upstreams = upstreams
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def session(self, upstream: str) -> aiohttp.ClientSession:
+        '''Return session of upstream, create it on first use.
+
+        Sessions are bound to the loop they are created on,
+        the sessions of a previous loop are dropped.'''
+
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._sessions = {}
+            self._loop = loop
+        session = self._sessions.get(upstream)
+        if session is None or session.closed:
+            settings = self.upstreams[upstream]
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+            )
+            session = self._sessions[upstream] = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    total=settings.timeout,
+                    sock_connect=settings.connect_timeout
+                )
+            )
+        return session
+
+    async def close(self) -> None:
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+    @asynccontextmanager
+    async def request(self, upstream: str, method: str, url: str, retries: int | None = None, **kwargs):
+        '''Make a request through the upstream session and yield the response.
+
+        Connection errors, timeouts and {RETRY_STATUSES} are retried
+        with exponential backoff and jitter. Without "retry_sent" only
+        errors raised before the request went out are retried.
+        Every attempt is recorded in "http_{upstream}_seconds" histogram.
+        URLs are not logged, they may carry a token.'''
+
+        settings = self.upstreams[upstream]
+        retries = settings.retries if retries is None else retries
+        latency = histogram(f'http_{upstream}_seconds')
+        session = self.session(upstream)
+
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                resp = await session.request(method, url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                latency.observe(time.perf_counter() - start)
+                sent = not isinstance(e, aiohttp.ClientConnectorError)
+                if attempt == retries or (sent and not settings.retry_sent):
+                    raise
+                logger.warning(f'{upstream}: {method} failed ({type(e).__name__}), retry {attempt + 1}/{retries}')
+            else:
+                latency.observe(time.perf_counter() - start)
+                if resp.status not in RETRY_STATUSES or attempt == retries:
+                    break
+                resp.release()
+                logger.warning(f'{upstream}: {method} status {resp.status}, retry {attempt + 1}/{retries}')
+            await asyncio.sleep(HTTP_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+        try:
+            yield resp
+        finally:
+            resp.release()
+
+
+http_clients = HttpClients()
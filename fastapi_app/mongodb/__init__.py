@@ -1 +1,2 @@
-from .mongodb import *
\ No newline at end of file
+from .mongodb import *
+from .prices import *
\ No newline at end of file
@@ -0,0 +1,136 @@
+'''Index bootstrap for users, pairs and other collections.
+
+Runs at FastAPI startup and from the command line. Run from fastapi_app directory:
+    python -m mongodb.indexes [--explain]'''
+
+__all__ = [
+    'INDEXES',
+    'ensure_indexes',
+    'explain_queries'
+]
+
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timezone
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from config import DATABASE
+from .mongodb import connect, disconnect, get_client
+from .prices import PRICES, ensure_prices_collection
+
+
+logger = logging.getLogger(__name__)
+
+
+INDEXES = {
+    'users': [
+        IndexModel([('user_id', ASCENDING)], name='user_id_unique', unique=True),
+        # multikey: which users track a pair
+        IndexModel([('pairs', ASCENDING)], name='pairs'),
+    ],
+    'pairs': [
+        IndexModel([('pair_name', ASCENDING)], name='pair_name_unique', unique=True),
+    ],
+    'other': [
+        IndexModel([('name', ASCENDING)], name='name_unique', unique=True),
+    ],
+}
+
+
+async def ensure_indexes(database=None) -> dict[str, list[str]]:
+    '''Create INDEXES, idempotent. Return names of ensured indexes by collection.
+
+    An index which can not be built (e.g. duplicate values for a unique
+    index, or an index with the same name and other options) is logged
+    and skipped, so the app still starts.'''
+
+    db = database if database is not None else get_client()[DATABASE]
+
+    report = {}
+    for collection, indexes in INDEXES.items():
+        report[collection] = []
+        for index in indexes:
+            try:
+                report[collection] += await db[collection].create_indexes([index])
+            except OperationFailure as e:
+                logger.warning(f"{collection}: index {index.document['name']} is not created: "
+                               f"{e.details.get('errmsg', e) if e.details else e}")
+    return report
+
+
+def _stages(plan) -> set[str]:
+    '''Collect every "stage" of a plan.'''
+
+    stages = set()
+    if isinstance(plan, dict):
+        if isinstance(plan.get('stage'), str):
+            stages.add(plan['stage'])
+        for value in plan.values():
+            stages |= _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages |= _stages(value)
+    return stages
+
+
+def _winning_stages(explain) -> set[str]:
+    '''Collect stages of winning plans only, rejected plans may use other indexes.
+    Explain of a time-series collection nests them in an aggregation.'''
+
+    stages = set()
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            stages |= _stages(value) if key == 'winningPlan' else _winning_stages(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            stages |= _winning_stages(value)
+    return stages
+
+
+async def explain_queries(database=None) -> list[tuple[str, str]]:
+    '''Explain the app's hot queries. Return (query, "IXSCAN" or the scan stages) pairs.'''
+
+    db = database if database is not None else get_client()[DATABASE]
+    since = datetime.now(tz=timezone.utc)
+
+    queries = {
+        'users.find_one(user_id)': db['users'].find({'user_id': 0}).limit(1),
+        'users.find().sort(user_id desc)': db['users'].find({}, {'_id': 0}).sort('user_id', DESCENDING),
+        'users.find(pairs)': db['users'].find({'pairs': 'bitcoin-usd'}),
+        'pairs.find_one(pair_name)': db['pairs'].find({'pair_name': 'bitcoin-usd'}).limit(1),
+        'other.find_one(name)': db['other'].find({'name': 'coins_list'}).limit(1),
+        'prices.find(pair_name, ts)': db[PRICES].find(
+            {'pair_name': 'bitcoin-usd', 'ts': {'$gt': since}}
+        ).sort('ts', ASCENDING),
+    }
+
+    report = []
+    for name, cursor in queries.items():
+        stages = _winning_stages(await cursor.explain())
+        report.append((name, 'IXSCAN' if 'IXSCAN' in stages else ', '.join(sorted(stages))))
+    return report
+
+
+async def _main(explain: bool) -> None:
+    connect()
+    try:
+        await ensure_prices_collection()
+        for collection, created in (await ensure_indexes()).items():
+            print(f'{collection}: {", ".join(created) or "no index ensured"}')
+        if explain:
+            for name, stage in await explain_queries():
+                print(f'{name:36}{stage}')
+    finally:
+        disconnect()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--explain', action='store_true', help='show which queries use an index')
+    args = parser.parse_args()
+    asyncio.run(_main(args.explain))
+
+
+if __name__ == '__main__':
+    main()
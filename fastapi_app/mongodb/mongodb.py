@@ -1,53 +1,156 @@
 __all__ = [
-    'unit_of_work'
+    'MongoRepo',
+    'unit_of_work',
+    'connect',
+    'disconnect',
+    'get_client'
 ]
 
+import asyncio
 from contextlib import asynccontextmanager
-from motor.motor_asyncio import AsyncIOMotorClient
-from config import DATABASE, MONGONET
-from pymongo.results import InsertOneResult, UpdateResult, DeleteResult
+from typing import Literal
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorClientSession
+from config import (DATABASE, MONGONET, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+                    MONGO_MAX_IDLE_TIME_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    MONGO_CONNECT_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS)
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult
+from .monitoring import PoolMetrics
+
+
+_client: AsyncIOMotorClient | None = None
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _running_loop() -> asyncio.AbstractEventLoop | None:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def connect(ip: str = MONGONET, port: int = 27017) -> AsyncIOMotorClient:
+    '''Create the process-wide Motor client with a tuned connection pool.
+
+    Called once from the FastAPI lifespan. Motor binds a client to the
+    event loop it first runs on, so a client of another loop (e.g. a test
+    client without lifespan runs every request on a new loop) is replaced.'''
+
+    global _client, _loop
+    loop = _running_loop()
+    if _client is not None and _loop is not loop:
+        disconnect()
+    if _client is None:
+        _loop = loop
+        _client = AsyncIOMotorClient(
+            ip,
+            port,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            event_listeners=[PoolMetrics()]
+        )
+    return _client
+
+
+def disconnect() -> None:
+    '''Close the process-wide Motor client.'''
+
+    global _client, _loop
+    if _client is not None:
+        _client.close()
+        _client = None
+        _loop = None
+
+
+def get_client() -> AsyncIOMotorClient:
+    '''Return the process-wide client of the running loop,
+    create it if lifespan did not run.'''
+
+    return _client if _client is not None and _loop is _running_loop() else connect()
 
 
 class MongoRepo:
 
-    def __init__(self, collection: str, ip: str = MONGONET, port: int = 27017, database: str = DATABASE) -> None:
-        self.client = AsyncIOMotorClient(ip, port)
+    def __init__(self,
+                 collection: str,
+                 client: AsyncIOMotorClient | None = None,
+                 database: str = DATABASE,
+                 session: AsyncIOMotorClientSession | None = None,
+                 read_only: bool = False) -> None:
+        self.client = client if client is not None else get_client()
         self.database = self.client[database]
         self.collection = self.database[collection]
+        self.session = session
+        self.read_only = read_only
         self.object_id = None
 
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise RuntimeError(f'{self.collection.name}: write in a read only unit of work')
+
     async def create(self, query: dict) -> bool:
-        res: InsertOneResult = await self.collection.insert_one(query)
+        self._check_writable()
+        res: InsertOneResult = await self.collection.insert_one(query, session=self.session)
         self.object_id = res.inserted_id
         return res.acknowledged
 
+    async def create_many(self, docs: list[dict]) -> bool:
+        self._check_writable()
+        res: InsertManyResult = await self.collection.insert_many(docs, session=self.session)
+        return res.acknowledged
+
     async def read(self, query: dict = None, projection: dict = {}) -> dict | None:
         _query = query if self.object_id is None else {'_id': self.object_id}
-        res = await self.collection.find_one(_query, projection)
+        res = await self.collection.find_one(_query, projection, session=self.session)
         if res:
             self.object_id = res['_id']
             return res
 
-    async def update(self, query: dict, filter_: dict = None) -> bool:
+    async def update(self, query: dict, filter_: dict = None, upsert: bool = False) -> bool:
+        self._check_writable()
         _filter = filter_ if self.object_id is None else {'_id': self.object_id}
         res: UpdateResult = await self.collection.update_one(
             _filter,
-            query
+            query,
+            upsert=upsert,
+            session=self.session
         )
         return res.acknowledged
 
     async def delete(self, query: dict = None) -> bool:
+        self._check_writable()
         _query = query if self.object_id is None else {'_id': self.object_id}
-        res: DeleteResult = await self.collection.delete_one(_query)
+        res: DeleteResult = await self.collection.delete_one(_query, session=self.session)
         return res.acknowledged
 
     async def find_id(self, query: dict, projection: dict = {'_id': 1}) -> str | None:
-        return await self.collection.find_one(query, projection)
+        return await self.collection.find_one(query, projection, session=self.session)
 
 
 @asynccontextmanager
-async def unit_of_work(collection: str):
-    m = MongoRepo(collection=collection)
-    async with await m.client.start_session() as s:
-        async with s.start_transaction():
-            yield m
+async def unit_of_work(collection: str,
+                       client: AsyncIOMotorClient | None = None,
+                       mode: Literal['read', 'write', 'transaction'] = 'write'):
+    '''Yield a repository of collection.
+
+    mode:
+        read - no session, writes raise RuntimeError
+        write - no session, every single-document operation is atomic on its own
+        transaction - operations run in one multi-document transaction,
+            needs a replica set; time-series collections can not be written in it'''
+
+    if mode == 'read':
+        yield MongoRepo(collection=collection, client=client, read_only=True)
+    elif mode == 'write':
+        yield MongoRepo(collection=collection, client=client)
+    elif mode == 'transaction':
+        m = MongoRepo(collection=collection, client=client)
+        async with await m.client.start_session() as s:
+            async with s.start_transaction():
+                m.session = s
+                yield m
+    else:
+        raise ValueError(f'unknown unit of work mode: {mode}')
@@ -0,0 +1,65 @@
+import time
+import threading
+from pymongo import monitoring
+from metrics import histogram, gauge
+
+
+__all__ = [
+    'PoolMetrics'
+]
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    '''Collect connection pool metrics of the shared Motor client.
+
+    Motor runs every pymongo call in an executor thread,
+    so a check out start and its result are reported by the same thread.'''
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self.total = gauge('mongo_pool_connections')
+        self.checked_out = gauge('mongo_pool_checked_out')
+        self.failed = gauge('mongo_pool_check_out_failed')
+        self.wait_time = histogram('mongo_pool_wait_seconds')
+
+    def _wait_done(self) -> None:
+        start = getattr(self._local, 'start', None)
+        if start is not None:
+            self.wait_time.observe(time.perf_counter() - start)
+            self._local.start = None
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        self.total.set(0)
+        self.checked_out.set(0)
+
+    def connection_created(self, event):
+        self.total.inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.total.dec()
+
+    def connection_check_out_started(self, event):
+        self._local.start = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._wait_done()
+        self.failed.inc()
+
+    def connection_checked_out(self, event):
+        self._wait_done()
+        self.checked_out.inc()
+
+    def connection_checked_in(self, event):
+        self.checked_out.dec()
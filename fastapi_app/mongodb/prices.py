@@ -0,0 +1,121 @@
+__all__ = [
+    'PRICES',
+    'ensure_prices_collection',
+    'hour_start',
+    'price_documents',
+    'refresh_range',
+    'to_milliseconds'
+]
+
+import time
+from datetime import datetime, timezone
+from pymongo import ASCENDING
+from config import DATABASE, PRICES_RETENTION_DAYS
+from .mongodb import get_client
+
+
+PRICES = 'prices'
+
+# CoinGecko returns 5-minute points for ranges shorter than one day,
+# so a delta request always spans at least a day to keep hourly points.
+# scheduler/tasks/tasks.py (PairTask) writes the same collection with
+# a copy of this module's logic, keep both in sync.
+MIN_RANGE = 60 * 60 * 25
+
+
+def to_milliseconds(ts: datetime) -> int:
+    '''Convert a stored (naive UTC) datetime back to a unix time in ms.'''
+
+    return round(ts.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def hour_start() -> int:
+    '''Return unix time in ms of the start of the current hour.
+
+    CoinGecko ends hourly data with a live point taken at request time,
+    it is off the hourly grid, so points from this hour are not stored.'''
+
+    return int(time.time()) // 3600 * 3600 * 1000
+
+
+def refresh_range(last_ts: int | None = None) -> tuple[int, int]:
+    '''Return (from, to) unix time in seconds for "market_chart/range".
+
+    Without stored data it is the whole retention window,
+    otherwise only points newer than {last_ts} (ms) are requested.'''
+
+    now = int(time.time())
+    then = now - 60 * 60 * 24 * PRICES_RETENTION_DAYS
+    if last_ts is not None:
+        then = max(then, min(last_ts // 1000, now - MIN_RANGE))
+    return then, now
+
+
+def price_documents(pair_name: str,
+                    data: dict,
+                    after: int | None = None,
+                    before: int | None = None) -> list[dict]:
+    '''Convert CoinGecko "market_chart" response to time-series documents.
+
+    Parameters
+    ----------
+
+    data:
+        format {'prices': [[1680724852129, 28276.70], ...],
+                'market_caps': [...], 'total_volumes': [...]}
+    after:
+        unix time in ms, skip points which are not newer.
+    before:
+        unix time in ms, skip points which are not older.'''
+
+    docs = []
+    for price, cap, volume in zip(data['prices'], data['market_caps'], data['total_volumes']):
+        if after is not None and price[0] <= after:
+            continue
+        if before is not None and price[0] >= before:
+            continue
+        docs.append({
+            'ts': datetime.fromtimestamp(price[0] / 1000, tz=timezone.utc),
+            'pair_name': pair_name,
+            'price': price[1],
+            'market_cap': cap[1],
+            'total_volume': volume[1]
+        })
+    return docs
+
+
+async def ensure_prices_collection(database=None) -> None:
+    '''Create a time-series collection for pair history with (pair_name, ts) index.
+
+    Points older than PRICES_RETENTION_DAYS are dropped by the server.
+    Idempotent. Pairs stored in the old layout (one document with
+    the whole "data" arrays) are moved to the new collection.
+    Same collection options as PairTask._prices_collection of the scheduler.'''
+
+    db = database if database is not None else get_client()[DATABASE]
+    retention = 60 * 60 * 24 * PRICES_RETENTION_DAYS
+
+    if PRICES not in await db.list_collection_names(filter={'name': PRICES}):
+        await db.create_collection(
+            PRICES,
+            timeseries={
+                'timeField': 'ts',
+                'metaField': 'pair_name',
+                'granularity': 'hours'
+            },
+            expireAfterSeconds=retention
+        )
+    else:
+        await db.command('collMod', PRICES, expireAfterSeconds=retention)
+    await db[PRICES].create_index([('pair_name', ASCENDING), ('ts', ASCENDING)])
+
+    async for pair in db['pairs'].find({'data': {'$exists': True}}):
+        docs = price_documents(pair['pair_name'], pair['data'], before=hour_start())
+        update = {'$unset': {'data': ''}}
+        # "data" is unset only after the insert: drop points of a migration
+        # interrupted in between, so a rerun does not duplicate them
+        await db[PRICES].delete_many({'pair_name': pair['pair_name']})
+        if docs:
+            await db[PRICES].insert_many(docs)
+            update['$set'] = {'last_ts': to_milliseconds(docs[-1]['ts'])}
+        await db['pairs'].update_one({'_id': pair['_id']}, update)
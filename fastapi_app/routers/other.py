@@ -1,4 +1,5 @@
 from fastapi import APIRouter
+import metrics
 from models import Other
 
 
@@ -20,3 +21,15 @@ async def update_other():
     return {
         'detail': 'successfull update'
     }
+
+
+@router.get('/metrics')
+async def get_metrics():
+    '''Return process metrics: mongodb pool usage and latencies.
+
+    :return: 200, metrics snapshot'''
+
+    return {
+        'status': 'success',
+        'data': metrics.snapshot()
+    }
@@ -1,9 +1,15 @@
-from fastapi import APIRouter, HTTPException
-from models import Pair, Pairs, Models, Other
+import numpy as np
+import pandas as pd
+from fastapi import APIRouter, HTTPException, Header, Response
+from config import CHART_WARM_TOP, STORAGE_CHAT
+from metrics import histogram
+from models import Pair, Pairs, Models, Other, COLUMNAR_MEDIA_TYPE, encode_frame, delivery_queue
 from models import (CoinIdIncorrect, VsCurrencyIncorrect,
                     UserNotFound, PairNotInDataBase,
                     PairNotInUserList, MlflowServerError,
-                    MlflowClientError, ModelURINotFound)
+                    ModelURINotFound,
+                    StorageChatNotConfigured, DeliveryQueueIsFull,
+                    CoinGeckoError)
 
 
 router = APIRouter(
@@ -18,7 +24,8 @@ async def add_pair(pair: Pair):
 
     :return: 200, pair successfully added,
     :return: 432, vs_currency not valid: {vs_currency},
-    :return: 433, coin not valid: {pair.coin_id}'''
+    :return: 433, coin not valid: {pair.coin_id},
+    :return: 451, CoinGecko did not return pair data'''
 
     try:
         return {
@@ -34,25 +41,49 @@ async def add_pair(pair: Pair):
             status_code=432,
             detail='vs currency is incorrect'
         )
+    except CoinGeckoError:
+        raise HTTPException(
+            status_code=451,
+            detail='pair data is not available from CoinGecko, try later'
+        )
 
 
-@router.get('/send_pic')
+@router.get('/send_pic', status_code=202)
 async def send_pic(user_id: int, coin_id: str, vs_currency: str, day: int = 7):
-    '''Send pic to user by POST request to Telegram Bot API.'''
+    '''Queue sending pic to user by POST request to Telegram Bot API.
+
+    The request is validated at once, the pic is rendered and sent
+    by a delivery job, see /pair/jobs/{job_id}.
+
+    :return: 202, job queued,
+    :return: 435, user not found,
+    :return: 436, pair not in users list,
+    :return: 438, pair not in database,
+    :return: 449, delivery queue is full'''
 
     try:
-        res = await Pairs.get_pic(
+        with histogram('delivery_chart_validate_seconds').time():
+            pair_data = await Other.checker(
+                user_id=user_id,
+                coin_id=coin_id,
+                vs_currency=vs_currency,
+                day=day
+            )
+        job = await delivery_queue.submit(
+            'chart',
+            user_id,
+            Pairs.get_pic,
             user_id=user_id,
             coin_id=coin_id,
             vs_currency=vs_currency,
-            day=day
+            day=day,
+            pair_data=pair_data
         )
-        if res:
-            return {
-                'status': 'success',
-                'detail': f'pic send to {user_id}',
-                'data': res
-            }
+        return {
+            'status': 'accepted',
+            'detail': f'pic for {user_id} is queued',
+            'data': job
+        }
     except PairNotInDataBase:
         raise HTTPException(
             status_code=438,
@@ -68,16 +99,80 @@ async def send_pic(user_id: int, coin_id: str, vs_currency: str, day: int = 7):
             status_code=435,
             detail='user not found'
         )
+    except DeliveryQueueIsFull:
+        raise HTTPException(
+            status_code=449,
+            detail='delivery queue is full, try later'
+        )
+
+
+@router.get('/jobs/{job_id}')
+async def delivery_job(job_id: str):
+    '''Status of a pic or forecast delivery job.
+
+    :return: 200, job,
+    :return: 450, job not found'''
+
+    job = await delivery_queue.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=450,
+            detail='job not found'
+        )
+    return {
+        'status': 'success',
+        'data': job
+    }
+
+
+@router.post('/warm_charts', status_code=202)
+async def warm_charts(top: int = CHART_WARM_TOP):
+    '''Queue pre-rendering and upload of the {top} most requested charts.
+    Called by scheduler after pairs update.
+
+    A warm-up outlasts the proxy read timeout, so it runs as a delivery
+    job, its summary is the job result, see /pair/jobs/{job_id}.
+
+    :return: 202, job queued,
+    :return: 448, storage chat is not configured,
+    :return: 449, delivery queue is full'''
+
+    try:
+        if not STORAGE_CHAT:
+            raise StorageChatNotConfigured()
+        job = await delivery_queue.submit('warm_charts', None, Pairs.warm_charts, top=top)
+        return {
+            'status': 'accepted',
+            'detail': job
+        }
+    except StorageChatNotConfigured:
+        raise HTTPException(
+            status_code=448,
+            detail='storage chat is not configured'
+        )
+    except DeliveryQueueIsFull:
+        raise HTTPException(
+            status_code=449,
+            detail='delivery queue is full, try later'
+        )
 
 
 @router.get('/get_pair')
-async def get_pair(coin_id: str, vs_currency: str, day: int):
+async def get_pair(coin_id: str, vs_currency: str, day: int, accept: str | None = Header(None)):
+    '''Return prices of pair for the last {day} days.
+
+    With "Accept: application/vnd.gecko.columns" the response is
+    a columnar frame of ds (int64 ms) and y (float64) instead of JSON.'''
     try:
         res = await Pairs.get_pair(
             coin_id=coin_id,
             vs_currency=vs_currency,
             day=day
         )
+        if accept and COLUMNAR_MEDIA_TYPE in accept:
+            prices = np.array(res, dtype='float64').reshape(-1, 2)
+            df = pd.DataFrame({'ds': prices[:, 0].astype('int64'), 'y': prices[:, 1]})
+            return Response(content=encode_frame(df), media_type=COLUMNAR_MEDIA_TYPE)
         return {
             'status': 'success',
             'prices': res
@@ -89,32 +184,52 @@ async def get_pair(coin_id: str, vs_currency: str, day: int):
         )
 
 
-@router.post('/forecast')
-async def forecast_prophet(day: int, user_id: int, pair: Pair, model: str = 'prophet-model'):
-    '''Forecast for {day} by {model_uri}'''
-    try:
-        await Other.checker(
-            user_id=user_id,
-            coin_id=pair.coin_id,
-            vs_currency=pair.vs_currency,
-            day=day
-        )
-        res = await Models.get_model_uri(
+@router.put('/model')
+async def register_model(pair: Pair, run_id: str, last_data: str):
+    '''Register the latest finished run of pair. Called by mlflow client.
+
+    :return: 200, run registered'''
+
+    return {
+        'status': 'success',
+        'detail': await Models.register_model(
             pair=f'{pair.coin_id}-{pair.vs_currency}',
-            model=model
+            run_id=run_id,
+            last_data=last_data
         )
-        params = dict({'day': str(day), **res})
-        forecast = await Models.forecast(**params)
+    }
+
 
-        pic = await Models.send_forecast_pic(
+@router.post('/forecast', status_code=202)
+async def forecast_prophet(day: int, user_id: int, pair: Pair, model: str = 'prophet-model'):
+    '''Forecast for {day} by {model_uri}.
+
+    User, pair and model are checked at once, the forecast
+    is made and sent by a delivery job, see /pair/jobs/{job_id}.'''
+    try:
+        with histogram('delivery_forecast_validate_seconds').time():
+            await Other.checker(
+                user_id=user_id,
+                coin_id=pair.coin_id,
+                vs_currency=pair.vs_currency,
+                day=day
+            )
+            res = await Models.get_model_uri(
+                pair=f'{pair.coin_id}-{pair.vs_currency}',
+                model=model
+            )
+        job = await delivery_queue.submit(
+            'forecast',
+            user_id,
+            Models.deliver_forecast,
             user_id=user_id,
             pair=pair,
-            forecast=forecast['predictions'],
-            day_before=day * 3
+            day=day,
+            model=res
         )
         return {
-            'status': 'success',
-            'detail': pic
+            'status': 'accepted',
+            'detail': job
         }
 
     except PairNotInDataBase:
@@ -132,6 +247,11 @@ async def forecast_prophet(day: int, user_id: int, pair: Pair, model: str = 'pro
             status_code=435,
             detail='user not found'
         )
+    except DeliveryQueueIsFull:
+        raise HTTPException(
+            status_code=449,
+            detail='delivery queue is full, try later'
+        )
     except MlflowServerError as e:
         await Models.create_run_by_pair(
             coin_id=pair.coin_id,
@@ -141,11 +261,6 @@ async def forecast_prophet(day: int, user_id: int, pair: Pair, model: str = 'pro
             status_code=439,
             detail=f'{e}, your model is preparing'
         )
-    except MlflowClientError as e:
-        raise HTTPException(
-            status_code=440,
-            detail=f'{e}'
-        )
     except ModelURINotFound:
         await Models.create_run_by_pair(
             coin_id=pair.coin_id,
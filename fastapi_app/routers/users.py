@@ -1,4 +1,7 @@
-from fastapi import APIRouter, HTTPException
+import json
+from typing import Literal
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from models import User, Users, Pair
 from models import (UserAlreadyExist, UserCreationError,
                     UserNotFound, UserUpdateError,
@@ -37,18 +40,31 @@ async def create_user(user: User):
 
 
 @router.get('/all')
-async def get_all_users():
-    '''Return all users data.
-
-    :return: 200, list with user's data'''
+async def get_all_users(limit: int | None = Query(None, gt=0, le=1000),
+                        after: int | None = None,
+                        fields: list[Literal['user_id', 'user_name', 'n_pairs', 'pairs']] | None = Query(None),
+                        stream: bool = False):
+    '''Return users data page by page, greater "user_id" first.
+
+    Pass "next" of a page as {after} to get the next one.
+    With {stream} users after {after} are sent as NDJSON while they are read,
+    {limit} is applied only if it is set.
+
+    :return: 200, list with user's data and "next" cursor'''
+
+    if stream:
+        return StreamingResponse(
+            (json.dumps(doc) + '\n' async for doc in Users.iter_users(after=after, fields=fields, limit=limit)),
+            media_type='application/x-ndjson'
+        )
 
-    res = await Users.get_all_users()
-    if res:
-        return {
-            'status': 'success',
-            'deatil': 'users data',
-            'data': res
-        }
+    res = await Users.get_all_users(limit=limit or 100, after=after, fields=fields)
+    return {
+        'status': 'success',
+        'deatil': 'users data',
+        'data': res['data'],
+        'next': res['next']
+    }
 
 
 @router.get('/{user_id}')
@@ -0,0 +1,34 @@
+import pandas as pd
+import pytest
+from models.columnar import encode_frame, decode_frame
+
+
+def test_frame_round_trip():
+    df = pd.DataFrame({
+        'ds': pd.date_range('2023-04-12 20:00:30', periods=48, freq='H'),
+        'yhat': [float(i) for i in range(48)],
+        'n': list(range(48))
+    })
+
+    res = decode_frame(encode_frame(df))
+
+    pd.testing.assert_frame_equal(res, df)
+
+
+def test_frame_is_smaller_than_json():
+    df = pd.DataFrame({
+        'ds': pd.date_range('2023-04-12 20:00:30', periods=168, freq='H'),
+        'yhat': [28276.702324588 + i for i in range(168)]
+    })
+
+    assert len(encode_frame(df)) < len(df.to_json())
+
+
+def test_object_column_is_not_supported():
+    with pytest.raises(ValueError):
+        encode_frame(pd.DataFrame({'pair': ['bitcoin-usd']}))
+
+
+def test_decode_wrong_data():
+    with pytest.raises(ValueError):
+        decode_frame(b'{"prices": []}')
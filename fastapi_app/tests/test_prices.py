@@ -0,0 +1,21 @@
+from mongodb.prices import price_documents, to_milliseconds
+
+
+DATA = {
+    'prices': [[1681326000000, 1.0], [1681329600000, 2.0], [1681331234567, 3.0]],
+    'market_caps': [[1681326000000, 10.0], [1681329600000, 20.0], [1681331234567, 30.0]],
+    'total_volumes': [[1681326000000, 5.0], [1681329600000, 6.0], [1681331234567, 7.0]]
+}
+
+
+def test_live_point_of_current_hour_is_skipped():
+    docs = price_documents('bitcoin-usd', DATA, before=1681329600000)
+
+    assert [doc['price'] for doc in docs] == [1.0]
+
+
+def test_last_stored_point_round_trip():
+    docs = price_documents('bitcoin-usd', DATA, after=1681326000000)
+
+    assert [doc['price'] for doc in docs] == [2.0, 3.0]
+    assert to_milliseconds(docs[-1]['ts']) == 1681331234567
@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from models.singleflight import SingleFlight
+
+
+async def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    calls = 0
+
+    async def render():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return 'file_id'
+
+    res = await asyncio.gather(*[flight.do('bitcoin-usd 7', render) for _ in range(5)])
+
+    assert calls == 1
+    assert [el[0] for el in res] == ['file_id'] * 5
+    assert [el[1] for el in res].count(True) == 1
+    assert flight.in_flight() == 0
+
+
+async def test_different_keys_do_not_wait_for_each_other():
+    flight = SingleFlight()
+
+    async def render(key):
+        await asyncio.sleep(0.01)
+        return key
+
+    res = await asyncio.gather(
+        flight.do('bitcoin-usd 7', lambda: render('a')),
+        flight.do('bitcoin-usd 3', lambda: render('b'))
+    )
+
+    assert res == [('a', True), ('b', True)]
+
+
+async def test_error_is_shared_and_key_is_released():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError('upload failed')
+
+    res = await asyncio.gather(*[flight.do('bitcoin-usd 7', fail) for _ in range(3)], return_exceptions=True)
+
+    assert all(isinstance(el, ValueError) for el in res)
+    assert flight.in_flight() == 0
+
+
+async def test_cancelled_waiter_does_not_cancel_call():
+    flight = SingleFlight()
+
+    async def render():
+        await asyncio.sleep(0.05)
+        return 'file_id'
+
+    leader = asyncio.ensure_future(flight.do('bitcoin-usd 7', render))
+    await asyncio.sleep(0)
+    waiter = asyncio.ensure_future(flight.do('bitcoin-usd 7', render))
+    await asyncio.sleep(0)
+    waiter.cancel()
+
+    assert await leader == ('file_id', True)
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+
+async def test_waiters_run_their_own_call_when_errors_are_not_shared():
+    flight = SingleFlight()
+    calls = []
+
+    def upload(chat_id):
+        async def call():
+            calls.append(chat_id)
+            await asyncio.sleep(0.01)
+            if chat_id == 1:
+                raise ValueError('bot was blocked by the user')
+            return chat_id
+        return call
+
+    res = await asyncio.gather(
+        *[flight.do('bitcoin-usd 7', upload(chat_id), share_errors=False) for chat_id in (1, 2, 3)],
+        return_exceptions=True
+    )
+
+    assert isinstance(res[0], ValueError)
+    assert res[1:] == [(2, True), (3, True)]
+    assert sorted(calls) == [1, 2, 3]
@@ -1,3 +1,4 @@
+import json
 from fastapi.testclient import TestClient
 from main import app
 
@@ -46,10 +47,40 @@ def test_users_data():
                 "n_pairs": 3,
                 "pairs": []
             }
-        ]
+        ],
+        "next": None
     }
 
 
+def test_users_data_page():
+    response = client.get(
+        '/user/all',
+        params={'limit': 1, 'fields': ['user_name']}
+    )
+
+    assert response.status_code == 200
+    assert response.json()['data'] == [{"user_id": 37317, "user_name": "kegga"}]
+    assert response.json()['next'] is None
+
+
+def test_users_data_stream():
+    response = client.get(
+        '/user/all',
+        params={'stream': True}
+    )
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {
+            "user_id": 37317,
+            "user_name": "kegga",
+            "n_pairs": 3,
+            "pairs": []
+        }
+    ]
+
+
 def test_user_data_fail():
     response = client.get(
         '/user/345272'
@@ -0,0 +1,89 @@
+'''Compare warm and cold start Prophet fits on one pair.
+
+Fits "yesterday's" model on all points but the last {shift} hours,
+then fits the full data from scratch and warm-started from it.
+Prints fit time and cross validation metrics (last CV_MAX_CUTOFFS cutoffs).
+
+Run from mlflow_client directory:
+    python -m benchmarks.warm_start bitcoin usd --repeat 3'''
+
+import argparse
+import logging
+import statistics
+import time
+import requests
+import pandas as pd
+from pandas.core.frame import DataFrame
+from prophet import Prophet
+from prophet.diagnostics import cross_validation, performance_metrics, generate_cutoffs
+from config import FASTAPI, CV_INITIAL, CV_PERIOD, CV_HORIZON, CV_MAX_CUTOFFS
+from routers.misc import warm_start_params
+
+
+CV_METRICS = ['mse', 'rmse', 'mape']
+
+
+def load(coin_id: str, vs_currency: str) -> DataFrame:
+    response = requests.get(
+        f'http://{FASTAPI}/pair/get_pair',
+        params={'coin_id': coin_id, 'vs_currency': vs_currency, 'day': '89'},
+        headers={'accept': 'application/json'}
+    )
+    df = pd.DataFrame(response.json()['prices'], columns=['ds', 'y'])
+    df.ds = pd.to_datetime(df.ds // 1000, unit='s')
+    return df
+
+
+def fit(df: DataFrame, init: dict | None = None) -> tuple[Prophet, float]:
+    m = Prophet()
+    start = time.perf_counter()
+    if init is not None:
+        m.fit(df, init=init)
+    else:
+        m.fit(df)
+    return m, time.perf_counter() - start
+
+
+def cv(m: Prophet, df: DataFrame) -> dict:
+    cutoffs = generate_cutoffs(
+        df,
+        horizon=pd.Timedelta(CV_HORIZON),
+        initial=pd.Timedelta(CV_INITIAL),
+        period=pd.Timedelta(CV_PERIOD)
+    )[-CV_MAX_CUTOFFS:]
+    res = cross_validation(m, horizon=CV_HORIZON, cutoffs=cutoffs, disable_tqdm=True)
+    return performance_metrics(res, metrics=CV_METRICS).loc[:, CV_METRICS].mean(axis=0).to_dict()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('coin_id')
+    parser.add_argument('vs_currency')
+    parser.add_argument('--shift', type=int, default=24, help='hours of new data since the previous run')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+    logging.getLogger('prophet').setLevel(logging.WARNING)
+
+    df = load(args.coin_id, args.vs_currency)
+    previous, _ = fit(df.iloc[:-args.shift])
+    init = warm_start_params(previous)
+
+    results = {}
+    for name, params in (('cold', None), ('warm', init)):
+        times = []
+        for _ in range(args.repeat):
+            m, seconds = fit(df, params)
+            times.append(seconds)
+        results[name] = {'fit_seconds': statistics.median(times), **cv(m, df)}
+
+    print(f'{args.coin_id}-{args.vs_currency}, {len(df)} points, {args.repeat} fits each')
+    print(f"{'':6}" + ''.join(f'{key:>14}' for key in results['cold']))
+    for name, res in results.items():
+        print(f'{name:6}' + ''.join(f'{value:>14.4f}' for value in res.values()))
+    print(f"speedup: {results['cold']['fit_seconds'] / results['warm']['fit_seconds']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
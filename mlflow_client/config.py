@@ -2,3 +2,23 @@ import os
 
 MLFLOW: str = os.getenv('MLFLOW')
 FASTAPI: str = os.getenv('FASTAPI')
+
+# loaded models cache
+MODEL_CACHE_SIZE: int = int(os.getenv('MODEL_CACHE_SIZE', 32))
+MODEL_CACHE_BYTES: int = int(os.getenv('MODEL_CACHE_BYTES', 512 * 1024 * 1024))
+MODEL_CACHE_TTL: float = float(os.getenv('MODEL_CACHE_TTL', 60 * 60 * 24))
+
+# training jobs, scheduler MODEL_WORKERS must match TRAIN_WORKERS
+TRAIN_WORKERS: int = int(os.getenv('TRAIN_WORKERS', 1))
+JOB_TTL: float = float(os.getenv('JOB_TTL', 60 * 60))
+
+# cross validation: full, sample or skip
+CV_MODE: str = os.getenv('CV_MODE', 'full')
+CV_WORKERS: int = int(os.getenv('CV_WORKERS', os.cpu_count() or 1))
+CV_MAX_CUTOFFS: int = int(os.getenv('CV_MAX_CUTOFFS', 3))
+CV_INITIAL: str = os.getenv('CV_INITIAL', '1800 hours')
+CV_PERIOD: str = os.getenv('CV_PERIOD', '60 hours')
+CV_HORIZON: str = os.getenv('CV_HORIZON', '120 hours')
+
+# start fits from the previous run's parameters
+WARM_START: bool = os.getenv('WARM_START', 'false').lower() in ('1', 'true', 'yes')
@@ -1,9 +1,17 @@
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from routers import proph
+from routers.jobs import train_queue
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    train_queue.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(proph.router)
 
 
@@ -0,0 +1,119 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import mlflow
+from collections import OrderedDict
+from config import MODEL_CACHE_SIZE, MODEL_CACHE_BYTES, MODEL_CACHE_TTL
+
+
+__all__ = [
+    'ModelCache',
+    'model_cache'
+]
+
+
+def _dir_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path) for name in files
+    )
+
+
+class ModelCache:
+    '''Thread-safe LRU cache of loaded pyfunc models keyed by model_uri.
+
+    Entries are evicted when there are more than {max_items} of them,
+    their artifacts take more than {max_bytes}, or they are older than {ttl} seconds.'''
+
+    def __init__(self,
+                 max_items: int = MODEL_CACHE_SIZE,
+                 max_bytes: int = MODEL_CACHE_BYTES,
+                 ttl: float = MODEL_CACHE_TTL) -> None:
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._models: OrderedDict[str, tuple] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loading: dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _load(model_uri: str) -> tuple:
+        '''Download artifacts of model and load it. Return (model, size in bytes).'''
+
+        dst_path = tempfile.mkdtemp(prefix='model-')
+        try:
+            local_path = mlflow.artifacts.download_artifacts(artifact_uri=model_uri, dst_path=dst_path)
+            return mlflow.pyfunc.load_model(local_path), _dir_size(local_path)
+        finally:
+            shutil.rmtree(dst_path, ignore_errors=True)
+
+    def _lookup(self, model_uri: str):
+        with self._lock:
+            entry = self._models.get(model_uri)
+            if entry is None:
+                return None
+            model, size, loaded_at = entry
+            if time.monotonic() - loaded_at > self.ttl:
+                del self._models[model_uri]
+                self._bytes -= size
+                return None
+            self._models.move_to_end(model_uri)
+            self.hits += 1
+            return model
+
+    def _store(self, model_uri: str, model, size: int) -> None:
+        with self._lock:
+            self._models[model_uri] = (model, size, time.monotonic())
+            self._bytes += size
+            while len(self._models) > 1 and (len(self._models) > self.max_items or self._bytes > self.max_bytes):
+                _, (_, evicted_size, _) = self._models.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def get(self, model_uri: str):
+        '''Return loaded model, load it from tracking server on a miss.
+
+        Concurrent misses of the same model_uri load it once.'''
+
+        model = self._lookup(model_uri)
+        if model is not None:
+            return model
+
+        with self._lock:
+            key_lock = self._loading.setdefault(model_uri, threading.Lock())
+
+        try:
+            with key_lock:
+                model = self._lookup(model_uri)
+                if model is not None:
+                    return model
+                with self._lock:
+                    self.misses += 1
+                model, size = self._load(model_uri)
+                self._store(model_uri, model, size)
+        finally:
+            # a failed load must not leave its key lock behind
+            with self._lock:
+                self._loading.pop(model_uri, None)
+        return model
+
+    def warm(self, model_uri: str) -> None:
+        '''Load model ahead of the first predict.'''
+
+        self.get(model_uri)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'models': list(self._models),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+model_cache = ModelCache()
@@ -0,0 +1,57 @@
+'''Columnar wire format shared with FastAPI, keep in sync with fastapi_app/models/columnar.py'''
+
+import json
+import struct
+import numpy as np
+import pandas as pd
+
+
+__all__ = [
+    'COLUMNAR_MEDIA_TYPE',
+    'encode_frame',
+    'decode_frame'
+]
+
+
+COLUMNAR_MEDIA_TYPE = 'application/vnd.gecko.columns'
+
+MAGIC = b'GCF1'
+HEADER_LEN = struct.Struct('<I')
+
+
+def encode_frame(df: pd.DataFrame) -> bytes:
+    '''Encode numeric/datetime columns of a DataFrame to a compact binary form.
+
+    Layout: b'GCF1', uint32 header length, JSON header
+    [[name, dtype, length], ...], then raw little-endian column buffers.'''
+
+    header, buffers = [], []
+    for name in df.columns:
+        values = df[name].to_numpy()
+        if values.dtype.kind not in 'iufbM':
+            raise ValueError(f'column {name} of type {values.dtype} is not supported')
+        values = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder('<'))
+        header.append([name, values.dtype.str, len(values)])
+        buffers.append(values.tobytes())
+
+    raw_header = json.dumps(header).encode('utf-8')
+    return b''.join([MAGIC, HEADER_LEN.pack(len(raw_header)), raw_header, *buffers])
+
+
+def decode_frame(data: bytes) -> pd.DataFrame:
+    '''Decode bytes made by encode_frame back to a DataFrame.'''
+
+    if data[:4] != MAGIC:
+        raise ValueError('not a columnar frame')
+
+    (header_len,) = HEADER_LEN.unpack_from(data, 4)
+    offset = 4 + HEADER_LEN.size
+    header = json.loads(data[offset:offset + header_len])
+    offset += header_len
+
+    columns = {}
+    for name, dtype, length in header:
+        dtype = np.dtype(dtype)
+        columns[name] = np.frombuffer(data, dtype=dtype, count=length, offset=offset)
+        offset += dtype.itemsize * length
+    return pd.DataFrame(columns)
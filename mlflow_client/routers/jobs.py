@@ -0,0 +1,115 @@
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable
+from config import TRAIN_WORKERS, JOB_TTL
+
+
+__all__ = [
+    'JobQueue',
+    'train_queue'
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    '''In-process queue of training jobs with per-key deduplication.
+
+    Jobs run in a pool of {workers} processes, so fits do not share
+    mlflow's active run or the GIL. While a job for a key is queued or
+    running, submitting the same key returns that job.
+
+    Job format:
+    {
+        "job_id": "9f1c...",
+        "key": "bitcoin-usd",
+        "status": "queued" | "running" | "finished" | "failed",
+        "result": {...} | None,
+        "error": "..." | None,
+        "created_at": 1681324830.1,
+        "finished_at": 1681324950.7 | None
+    }'''
+
+    def __init__(self, workers: int = TRAIN_WORKERS, ttl: float = JOB_TTL) -> None:
+        self.workers = workers
+        self.ttl = ttl
+        self._processes: ProcessPoolExecutor | None = None
+        self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs: dict[str, dict] = {}
+        self._active: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _get_processes(self) -> ProcessPoolExecutor:
+        # _run threads start jobs concurrently, only one may create the pool
+        with self._lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._processes
+
+    def _prune(self) -> None:
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job['finished_at'] and now - job['finished_at'] > self.ttl:
+                del self._jobs[job_id]
+
+    def _run(self, job_id: str, func: Callable, on_success: Callable | None, kwargs: dict) -> None:
+        job = self._jobs[job_id]
+        job['status'] = 'running'
+        try:
+            job['result'] = self._get_processes().submit(func, **kwargs).result()
+            if on_success is not None:
+                on_success(job['result'])
+            job['status'] = 'finished'
+        except Exception as e:
+            logger.warning(f"Job {job_id} ({job['key']}) failed: {e}")
+            job['error'] = f'{e}'
+            job['status'] = 'failed'
+        finally:
+            job['finished_at'] = time.time()
+            with self._lock:
+                self._active.pop(job['key'], None)
+
+    def submit(self, key: str, func: Callable, on_success: Callable | None = None, **kwargs) -> dict:
+        '''Queue {func}(**kwargs) unless a job for {key} is in flight. Return the job.
+
+        {func} runs in a worker process, {on_success} gets its result in this process.'''
+
+        with self._lock:
+            self._prune()
+            job_id = self._active.get(key)
+            if job_id is not None:
+                return self._jobs[job_id]
+
+            job_id = uuid.uuid4().hex
+            job = self._jobs[job_id] = {
+                'job_id': job_id,
+                'key': key,
+                'status': 'queued',
+                'result': None,
+                'error': None,
+                'created_at': time.time(),
+                'finished_at': None
+            }
+            self._active[key] = job_id
+
+        self._threads.submit(self._run, job_id, func, on_success, kwargs)
+        return job
+
+    def get(self, job_id: str) -> dict | None:
+        return self._jobs.get(job_id)
+
+    def shutdown(self) -> None:
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+
+
+train_queue = JobQueue()
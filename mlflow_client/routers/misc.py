@@ -1,12 +1,21 @@
 import mlflow
 import time
+import logging
+import requests
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
 from pandas import DateOffset
 from pandas.core.frame import DataFrame
 from mlflow import MlflowClient
-from config import MLFLOW
+from config import (MLFLOW, FASTAPI, CV_MODE, CV_WORKERS, CV_MAX_CUTOFFS,
+                    CV_INITIAL, CV_PERIOD, CV_HORIZON, WARM_START)
 from prophet import Prophet
-from prophet.diagnostics import cross_validation, performance_metrics
+from prophet.diagnostics import cross_validation, performance_metrics, generate_cutoffs
+from .columnar import COLUMNAR_MEDIA_TYPE, decode_frame
+
+
+logger = logging.getLogger(__name__)
 
 
 def get_client() -> MlflowClient:
@@ -15,9 +24,116 @@ def get_client() -> MlflowClient:
     del client
 
 
-def single_run(df: DataFrame, experiment_id: str) -> dict:
-    '''Create a single run. Return a dict with response.'''
+def warm_start_params(m: Prophet) -> dict:
+    '''Return fitted parameters of a model to initialize the next fit.'''
+
+    res = {}
+    for pname in ['k', 'm', 'sigma_obs']:
+        if m.mcmc_samples == 0:
+            res[pname] = m.params[pname][0][0]
+        else:
+            res[pname] = np.mean(m.params[pname])
+    for pname in ['delta', 'beta']:
+        if m.mcmc_samples == 0:
+            res[pname] = m.params[pname][0]
+        else:
+            res[pname] = np.mean(m.params[pname], axis=0)
+    return res
+
+
+def previous_params(client: MlflowClient, experiment_id: str, model: str = 'prophet-model') -> dict | None:
+    '''Return warm start parameters of the latest finished run, None if there is no one.'''
+
+    runs = client.search_runs(
+        [experiment_id],
+        filter_string="attributes.status = 'FINISHED'",
+        max_results=1,
+        order_by=['attributes.start_time DESC']
+    )
+    if not runs:
+        return None
+    try:
+        return warm_start_params(mlflow.prophet.load_model(f'runs:/{runs[0].info.run_id}/{model}'))
+    except Exception as e:
+        logger.warning(f'Warm start is not available, fit from scratch: {e}')
+        return None
+
+
+def train_pair(coin_id: str, vs_currency: str, cv_mode: str = CV_MODE, warm_start: bool = WARM_START) -> dict:
+    '''Load 89 days of pair data from FastAPI and fit a run in the pair experiment.
+
+    With {warm_start} the optimizer starts from parameters of the previous run.
+    Runs in a job worker process. Return single_run response,
+    raise RuntimeError if the run failed.'''
+
+    EXPERIMENT = f'{coin_id}-{vs_currency}'
+    mlflow.set_tracking_uri(f'http://{MLFLOW}:5000')
+    client = MlflowClient(tracking_uri=f'http://{MLFLOW}:5000')
+
+    headers = {
+        'accept': f'{COLUMNAR_MEDIA_TYPE}, application/json;q=0.5',
+    }
+
+    params = {
+        'coin_id': coin_id,
+        'vs_currency': vs_currency,
+        'day': '89',
+    }
+
+    response = requests.get(f'http://{FASTAPI}/pair/get_pair', params=params, headers=headers)
+
+    if response.headers.get('content-type') == COLUMNAR_MEDIA_TYPE:
+        df = decode_frame(response.content)
+    else:
+        df = pd.DataFrame(response.json()['prices'], columns=['ds', 'y'])
+    data_last_ts = int(df.ds.iloc[-1])
+    df.ds = df.ds // 1000
+    df.ds = pd.to_datetime(df.ds, unit='s')
+
+    exp = client.get_experiment_by_name(EXPERIMENT)
+    init = None
+    if exp:
+        exp_id = exp.experiment_id
+        if warm_start:
+            init = previous_params(client, exp_id)
+    else:
+        exp_id = mlflow.create_experiment(EXPERIMENT)
+
+    res = single_run(df=df, experiment_id=exp_id, data_last_ts=data_last_ts, cv_mode=cv_mode, init=init)
+    if isinstance(res, str):
+        raise RuntimeError(res)
+    res['detail'].update(pair=EXPERIMENT, coin_id=coin_id, vs_currency=vs_currency)
+    return res
+
+
+def _cv_cutoffs(df: DataFrame, cv_mode: str) -> list | None:
+    '''Return cutoffs for cross validation: None means all of them.'''
+
+    if cv_mode != 'sample':
+        return None
+    cutoffs = generate_cutoffs(
+        df,
+        horizon=pd.Timedelta(CV_HORIZON),
+        initial=pd.Timedelta(CV_INITIAL),
+        period=pd.Timedelta(CV_PERIOD)
+    )
+    return cutoffs[-CV_MAX_CUTOFFS:]
+
+
+def single_run(df: DataFrame,
+               experiment_id: str,
+               data_last_ts: int | None = None,
+               cv_mode: str = CV_MODE,
+               init: dict | None = None) -> dict:
+    '''Create a single run. Return a dict with response.
+
+    {data_last_ts} is unix time (ms) of the last training point,
+    scheduler skips retraining while it is still the latest one.
+    {cv_mode}: "full" - all cutoffs, "sample" - last CV_MAX_CUTOFFS cutoffs,
+    "skip" - no cross validation. Cutoffs are fitted in CV_WORKERS processes.
+    {init} - parameters from warm_start_params to start the optimizer from.'''
     time_now = int(time.time())
+    status = 'FINISHED'
     try:
         m = Prophet()
         mlflow.start_run(
@@ -26,30 +142,81 @@ def single_run(df: DataFrame, experiment_id: str) -> dict:
             tags={"model": "prophet", "priority": "P1"},
             description=f'Model create run at {time_now}'
         )
-        m.fit(df)
+        start = time.perf_counter()
+        if init is not None:
+            m.fit(df, init=init)
+        else:
+            m.fit(df)
+        timings = {'fit_seconds': time.perf_counter() - start}
 
         model_params = {
             name: value for name, value in vars(m).items() if np.isscalar(value)
         }
         mlflow.log_params(model_params)
-        mlflow.log_param('last_day', str(df.ds.iloc[-1] + DateOffset(hours=1)))
+        last_day = str(df.ds.iloc[-1] + DateOffset(hours=1))
+        mlflow.log_param('last_day', last_day)
+        if data_last_ts is not None:
+            mlflow.log_param('data_last_ts', data_last_ts)
+        mlflow.log_param('cv_mode', cv_mode)
+        mlflow.log_param('warm_start', init is not None)
 
-        cv_results = cross_validation(
-            m, initial='1800 hours', period='60 hours', horizon='120 hours'
-        )
+        if cv_mode != 'skip':
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=CV_WORKERS) as pool:
+                cv_results = cross_validation(
+                    m,
+                    initial=CV_INITIAL,
+                    period=CV_PERIOD,
+                    horizon=CV_HORIZON,
+                    cutoffs=_cv_cutoffs(df, cv_mode),
+                    parallel=pool
+                )
+            timings['cv_seconds'] = time.perf_counter() - start
+
+            cv_metrics = ["mse", "rmse", "mape"]
+            metrics_results = performance_metrics(cv_results, metrics=cv_metrics)
+            average_metrics = metrics_results.loc[:, cv_metrics].mean(axis=0).to_dict()
+            mlflow.log_metrics(average_metrics)
 
-        cv_metrics = ["mse", "rmse", "mape"]
-        metrics_results = performance_metrics(cv_results, metrics=cv_metrics)
-        average_metrics = metrics_results.loc[:, cv_metrics].mean(axis=0).to_dict()
-        mlflow.log_metrics(average_metrics)
+        start = time.perf_counter()
         model_info = mlflow.prophet.log_model(m, "prophet-model")
-        mlflow.end_run()
+        timings['log_model_seconds'] = time.perf_counter() - start
+        mlflow.log_metrics(timings)
         return {
             'code': 200,
             'detail': {
                 'message': 'successful run',
-                'model_uri': model_info.model_uri
+                'model_uri': model_info.model_uri,
+                'run_id': model_info.run_id,
+                'last_data': last_day
             }
         }
     except Exception as e:
+        status = 'FAILED'
         return f'Exception {e}'
+    finally:
+        # train worker processes are reused, a run left active
+        # would swallow the next job's run
+        mlflow.end_run(status=status)
+
+
+def make_forecast(model, last_data: str, day: int) -> DataFrame:
+    '''Predict {day} days of hourly points starting at {last_data}.'''
+
+    test_dates = pd.date_range(start=last_data, periods=24 * day, freq="H")
+    test_df = pd.Series(data=test_dates.values, name="ds").to_frame()
+    return model.predict(test_df)
+
+
+def register_run(coin_id: str, vs_currency: str, run_id: str, last_data: str) -> None:
+    '''Tell FastAPI about the latest finished run, so forecasts skip Mlflow server lookups.'''
+
+    try:
+        requests.put(
+            f'http://{FASTAPI}/pair/model',
+            params={'run_id': run_id, 'last_data': last_data},
+            json={'coin_id': coin_id, 'vs_currency': vs_currency},
+            timeout=10
+        )
+    except requests.RequestException as e:
+        logger.warning(f'Run {run_id} is not registered: {e}')
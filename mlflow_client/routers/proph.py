@@ -1,10 +1,15 @@
-import requests
+import json
+import logging
 import mlflow
-import pandas as pd
-from mlflow import MlflowClient
-from fastapi import APIRouter, Depends, HTTPException
-from config import MLFLOW, FASTAPI
-from .misc import get_client, single_run
+from typing import Literal
+from pydantic import BaseModel, Field
+from fastapi import APIRouter, HTTPException, Header, Response
+from fastapi.responses import StreamingResponse
+from config import MLFLOW, CV_MODE, WARM_START
+from .misc import train_pair, register_run, make_forecast
+from .cache import model_cache
+from .columnar import COLUMNAR_MEDIA_TYPE, encode_frame
+from .jobs import train_queue
 from mlflow.exceptions import RestException
 
 
@@ -14,16 +19,38 @@ router = APIRouter(
     tags=['Prophet']
 )
 mlflow.set_tracking_uri(f'http://{MLFLOW}:5000')
+logger = logging.getLogger(__name__)
 
 
-@router.post('/do_run')
-def create_prophet_run(coin_id: str, vs_currency: str, client: MlflowClient = Depends(get_client)):
-    '''Create a one run of Prophet Model.
+def _on_run_finished(res: dict) -> None:
+    '''Warm model cache and register the run in FastAPI.
 
-    Firstly, it find a existing experiment by name.
-    If experiment does not exist, create a new one.
-    Then create a run, save metadata and fitted model.
-    Return
+    The run is finished either way, a failed warm-up only
+    leaves the model to load on the first predict.'''
+
+    try:
+        model_cache.warm(res['detail']['model_uri'])
+    except Exception as e:
+        logger.warning(f"Model {res['detail']['model_uri']} is not cached: {e}")
+    register_run(
+        coin_id=res['detail']['coin_id'],
+        vs_currency=res['detail']['vs_currency'],
+        run_id=res['detail']['run_id'],
+        last_data=res['detail']['last_data']
+    )
+
+
+@router.post('/do_run', status_code=202)
+def create_prophet_run(coin_id: str,
+                       vs_currency: str,
+                       cv_mode: Literal['full', 'sample', 'skip'] = CV_MODE,
+                       warm_start: bool = WARM_START):
+    '''Queue a one run of Prophet Model and return a job handle at once.
+
+    The job finds a existing experiment by name.
+    If experiment does not exist, it creates a new one.
+    Then it creates a run, saves metadata and fitted model.
+    Only one job per pair is in flight: repeated calls return the same job.
 
     Parameters
     ----------
@@ -33,58 +60,54 @@ def create_prophet_run(coin_id: str, vs_currency: str, client: MlflowClient = De
         for example: bitcoin, ethereum, etc.
     vs_currency:
         mast be string, examples: usd, rub, eth
-    client:
-        mlflow client to work with mlflow API.
+    cv_mode:
+        "full" - all CV cutoffs, "sample" - only the last ones,
+        "skip" - no cross validation, for quick retrains
+    warm_start:
+        initialize the optimizer from the previous run's parameters
 
     Return a dict with format:
-        :return:code: 200 - successful run
-        :return:code: 433 - failed run'''
-
-    EXPERIMENT = f'{coin_id}-{vs_currency}'
-
-    headers = {
-        'accept': 'application/json',
+        :return:code: 202 - job queued, poll /prophet/jobs/{job_id}'''
+
+    job = train_queue.submit(
+        f'{coin_id}-{vs_currency}',
+        train_pair,
+        on_success=_on_run_finished,
+        coin_id=coin_id,
+        vs_currency=vs_currency,
+        cv_mode=cv_mode,
+        warm_start=warm_start
+    )
+    return {
+        'code': 202,
+        'detail': job
     }
 
-    params = {
-        'coin_id': coin_id,
-        'vs_currency': vs_currency,
-        'day': '89',
-    }
 
-    response = requests.get(f'http://{FASTAPI}/pair/get_pair', params=params, headers=headers)
+@router.get('/jobs/{job_id}')
+def get_job(job_id: str):
+    '''Return status of a training job.
 
-    prices = response.json()['prices']
-    df = pd.DataFrame(prices, columns=['ds', 'y'])
-    df.ds = df.ds // 1000
-    df.ds = pd.to_datetime(df.ds, unit='s')
+    Rerurn a JSON
+        :return:code: 200 - job, "status" is queued, running, finished or failed
+        :return:code: 446 - job not found'''
 
-    exp = client.get_experiment_by_name(EXPERIMENT)
-    if exp:
-        res = single_run(
-            df=df,
-            experiment_id=exp.experiment_id
-        )
-    else:
-        exp_id = mlflow.create_experiment(EXPERIMENT)
-        res = single_run(
-            df=df,
-            experiment_id=exp_id
-        )
-    if isinstance(res, str):
+    job = train_queue.get(job_id)
+    if job is None:
         raise HTTPException(
-            status_code=443,
+            status_code=446,
             detail={
-                'message': 'failed run',
-                'data': res
+                'message': f'job {job_id} not found'
             }
         )
-    else:
-        return res
+    return {
+        'code': 200,
+        'detail': job
+    }
 
 
 @router.post('/predict')
-def predict_prophet(day: int, model_uri: str, last_data: str):
+def predict_prophet(day: int, model_uri: str, last_data: str, accept: str | None = Header(None)):
     '''Forecast for {day}
 
     Parameters
@@ -99,14 +122,14 @@ def predict_prophet(day: int, model_uri: str, last_data: str):
 
     Rerurn a JSON
         :return:code: 200 - forecast data
-        :return:code: 444 - value error'''
-    try:
-        loaded_model = mlflow.pyfunc.load_model(model_uri)
-
-        test_dates = pd.date_range(start=last_data, periods=24 * day, freq="H")
-        test_df = pd.Series(data=test_dates.values, name="ds").to_frame()
+        :return:code: 444 - value error
 
-        preds = loaded_model.predict(test_df)
+    With "Accept: application/vnd.gecko.columns" forecast data
+    is returned as a columnar frame instead of JSON.'''
+    try:
+        preds = make_forecast(model_cache.get(model_uri), last_data, day)
+        if accept and COLUMNAR_MEDIA_TYPE in accept:
+            return Response(content=encode_frame(preds), media_type=COLUMNAR_MEDIA_TYPE)
         return {
             'code': 200,
             'predictions': preds.to_json()
@@ -126,3 +149,76 @@ def predict_prophet(day: int, model_uri: str, last_data: str):
                 'message': f'{e}'
             }
         )
+
+
+class ForecastItem(BaseModel):
+    model_uri: str
+    last_data: str
+    day: int = Field(gt=0)
+
+
+def _batch_lines(items: list[ForecastItem]):
+    '''Yield NDJSON lines: each model is loaded once and predicts once
+    for its largest horizon, smaller horizons are sliced from it.'''
+
+    groups: dict[tuple, list[ForecastItem]] = {}
+    for item in items:
+        groups.setdefault((item.model_uri, item.last_data), []).append(item)
+
+    for (model_uri, last_data), group in groups.items():
+        try:
+            preds = make_forecast(model_cache.get(model_uri), last_data, max(el.day for el in group))
+            results = [
+                {'code': 200, 'predictions': preds.iloc[:24 * el.day].to_json()} for el in group
+            ]
+        except (RestException, OSError) as e:
+            results = [{'code': 444, 'message': f'{model_uri} not found', 'data': f'{e}'}] * len(group)
+        except ValueError as e:
+            results = [{'code': 445, 'message': f'{e}'}] * len(group)
+
+        for item, res in zip(group, results):
+            yield json.dumps({**item.dict(), **res}) + '\n'
+
+
+@router.post('/predict_batch')
+def predict_prophet_batch(items: list[ForecastItem]):
+    '''Forecast many (model_uri, last_data, day) items in one call.
+
+    Results are streamed as NDJSON, one line per item:
+    {"model_uri": ..., "last_data": ..., "day": 3, "code": 200, "predictions": "..."}
+    Failed items carry code 444 (model not found) or 445 (value error).'''
+
+    return StreamingResponse(_batch_lines(items), media_type='application/x-ndjson')
+
+
+@router.post('/warm')
+def warm_model(model_uri: str):
+    '''Load model into cache, e.g. when a new latest run is promoted.
+
+    Rerurn a JSON
+        :return:code: 200 - model is cached
+        :return:code: 444 - model not found'''
+    try:
+        model_cache.warm(model_uri)
+        return {
+            'code': 200,
+            'detail': model_cache.stats()
+        }
+    except (RestException, OSError) as e:
+        raise HTTPException(
+            status_code=444,
+            detail={
+                'message': f'{model_uri} not found',
+                'data': f'{e}'
+            }
+        )
+
+
+@router.get('/cache')
+def cache_stats():
+    '''Return cached models, their size and hit/miss counters.'''
+
+    return {
+        'code': 200,
+        'detail': model_cache.stats()
+    }
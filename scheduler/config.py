@@ -3,5 +3,24 @@ import os
 MONGO = os.getenv('MONGO')
 MLFLOW_CLIENT = os.getenv('MLFLOW_CLIENT')
 MLFLOW_SERVER = os.getenv('MLFLOW_SERVER')
+FASTAPI = os.getenv('FASTAPI')
 ADMIN: int = int(os.getenv('ADMIN'))
 TOKEN: str = os.getenv('TOKEN')
+PRICES_RETENTION_DAYS: int = int(os.getenv('PRICES_RETENTION_DAYS', 89))
+PAIR_UPDATE_HOURS: int = int(os.getenv('PAIR_UPDATE_HOURS', 1))
+
+# CoinGecko quota: free plan allows 10-30 calls per minute
+GECKO_CALLS_PER_MINUTE: int = int(os.getenv('GECKO_CALLS_PER_MINUTE', 10))
+GECKO_BURST: int = int(os.getenv('GECKO_BURST', 1))
+GECKO_CONCURRENCY: int = int(os.getenv('GECKO_CONCURRENCY', 4))
+GECKO_MAX_RETRIES: int = int(os.getenv('GECKO_MAX_RETRIES', 3))
+
+# nightly retraining, MODEL_WORKERS must match mlflow client TRAIN_WORKERS:
+# more jobs only wait in its queue
+MODEL_WORKERS: int = int(os.getenv('MODEL_WORKERS', 1))
+MODEL_POLL_INTERVAL: float = float(os.getenv('MODEL_POLL_INTERVAL', 10))
+MODEL_JOB_TIMEOUT: float = float(os.getenv('MODEL_JOB_TIMEOUT', 60 * 60))
+
+# chart warm-up after pairs update
+CHART_WARM_TOP: int = int(os.getenv('CHART_WARM_TOP', 50))
+CHART_WARM_TIMEOUT: float = float(os.getenv('CHART_WARM_TIMEOUT', 30))
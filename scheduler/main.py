@@ -1,15 +1,25 @@
 import schedule
 import time
 from tasks import PairTask, ModelTask, GeckoCoinAPIException
+from config import PAIR_UPDATE_HOURS
+
+
+# result of the last pairs update, the admin is notified when it changes
+last_update: str | None = None
 
 
 def pair_job():
+    global last_update
     p = PairTask()
     try:
         p.update_data()
-        PairTask.admin_notification('successfully')
+        result = 'successfully'
     except GeckoCoinAPIException:
-        PairTask.admin_notification('fail')
+        result = 'fail'
+    if result != last_update:
+        PairTask.admin_notification(result)
+        last_update = result
+    PairTask.warm_charts()
 
 
 def model_job():
@@ -18,7 +28,7 @@ def model_job():
 
 
 schedule.every().day.at("10:00").do(model_job)
-schedule.every(12).hours.at("10:00").do(pair_job)
+schedule.every(PAIR_UPDATE_HOURS).hours.at("10:00").do(pair_job)
 
 
 while True:
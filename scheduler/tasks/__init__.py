@@ -1 +1,2 @@
-from .tasks import *
\ No newline at end of file
+from .tasks import *
+from .limiter import *
\ No newline at end of file
@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+
+__all__ = [
+    'TokenBucket'
+]
+
+
+class TokenBucket:
+    '''Asyncio token bucket shared by all concurrent requests to one API.
+
+    Parameters
+    ----------
+
+    rate:
+        tokens added per second, for example 10 / 60 for 10 calls per minute
+    capacity:
+        maximum burst size'''
+
+    def __init__(self, rate: float, capacity: int = 1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        '''Wait until a token is available and take it.'''
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        '''Stop handing out tokens for {seconds}, e.g. after HTTP 429.'''
+
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0.0
@@ -1,9 +1,16 @@
+import asyncio
+import aiohttp
 import requests
 import time
 import logging
-from datetime import datetime
-from pymongo import MongoClient
-from config import MONGO, MLFLOW_CLIENT, MLFLOW_SERVER, TOKEN, ADMIN
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pymongo import MongoClient, ASCENDING
+from config import (MONGO, MLFLOW_CLIENT, MLFLOW_SERVER, FASTAPI, TOKEN, ADMIN, PRICES_RETENTION_DAYS,
+                    CHART_WARM_TOP, CHART_WARM_TIMEOUT,
+                    GECKO_CALLS_PER_MINUTE, GECKO_BURST, GECKO_CONCURRENCY, GECKO_MAX_RETRIES,
+                    MODEL_WORKERS, MODEL_POLL_INTERVAL, MODEL_JOB_TIMEOUT)
+from .limiter import TokenBucket
 
 
 __all__ = [
@@ -18,6 +25,13 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
+# CoinGecko returns 5-minute points for ranges shorter than one day,
+# so a delta request always spans at least a day to keep hourly points.
+# Copy of fastapi_app/mongodb/prices.py (the services share no code),
+# the range, document and collection logic below must stay in sync with it.
+MIN_RANGE = 60 * 60 * 25
+
+
 class GeckoCoinAPIException(BaseException):
     pass
 
@@ -29,28 +43,62 @@ class PairTask:
                  port: int = 27017,
                  database: str = 'main_database',
                  users: str = 'users',
-                 pairs: str = 'pairs') -> None:
+                 pairs: str = 'pairs',
+                 prices: str = 'prices') -> None:
         """Earn data from mongodb like unique pairs."""
 
         self.client = MongoClient(address, port)
         self.db = self.client.get_database(database)
         self.users = self.db.get_collection(users)
         self.pairs = self.db.get_collection(pairs)
+        self.prices = self._prices_collection(prices)
         self._pairs_update = {el['pair_name'] for el in self.pairs.find({}, {'pair_name': 1})}
         self._pairs_insert = set()
         for el in self.users.find({'pairs': {'$ne': []}}):
             self._pairs_insert = self._pairs_insert.union(set(el['pairs']) - self._pairs_update)
 
+    def _prices_collection(self, name: str):
+        '''Return the time-series collection with pair history, create it if needed.
+
+        Points older than PRICES_RETENTION_DAYS are dropped by the server.
+        Same options as ensure_prices_collection of fastapi app, which also
+        migrates pairs of the old layout.'''
+
+        retention = 60 * 60 * 24 * PRICES_RETENTION_DAYS
+        if name not in self.db.list_collection_names(filter={'name': name}):
+            self.db.create_collection(
+                name,
+                timeseries={
+                    'timeField': 'ts',
+                    'metaField': 'pair_name',
+                    'granularity': 'hours'
+                },
+                expireAfterSeconds=retention
+            )
+        collection = self.db.get_collection(name)
+        collection.create_index([('pair_name', ASCENDING), ('ts', ASCENDING)])
+        return collection
+
     @staticmethod
-    def _request(pair: str) -> dict:
-        '''Make request to GeckoCoinAPI to get data'''
+    async def _request(session: aiohttp.ClientSession,
+                       limiter: TokenBucket,
+                       pair: str,
+                       last_ts: int | None = None) -> dict:
+        '''Make request to GeckoCoinAPI to get data.
+
+        Without {last_ts} (ms) the whole retention window is requested,
+        otherwise only points after it. On HTTP 429 the shared limiter
+        is paused for "Retry-After" seconds and the request is repeated.'''
 
         coin_id, vs_currency = pair.split('-')
 
         headers = {'accept': 'application/json'}
 
+        # same range as refresh_range of fastapi app
         NOW = int(time.time())
-        THEN = NOW - 60 * 60 * 24 * 89
+        THEN = NOW - 60 * 60 * 24 * PRICES_RETENTION_DAYS
+        if last_ts is not None:
+            THEN = max(THEN, min(last_ts // 1000, NOW - MIN_RANGE))
 
         params = {
             'vs_currency': vs_currency,
@@ -58,34 +106,119 @@ class PairTask:
             'to': NOW,
         }
 
-        resp = requests.get(f'https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart/range',
-                            params=params,
-                            headers=headers)
+        for attempt in range(GECKO_MAX_RETRIES + 1):
+            await limiter.acquire()
+            async with session.get(f'https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart/range',
+                                   params=params,
+                                   headers=headers) as resp:
+                if resp.status == 429:
+                    try:
+                        delay = float(resp.headers.get('Retry-After'))
+                    except (TypeError, ValueError):
+                        delay = 60 * 2 ** attempt
+                    logger.warning(f'Pair {pair}: rate limited, retry in {delay} seconds')
+                    limiter.pause(delay)
+                    continue
+                pair_data: dict = await resp.json()
+            if pair_data.get('prices'):
+                return pair_data
+            break
+        raise GeckoCoinAPIException(f'Pair {pair} data update fail')
+
+    def _last_ts(self, pair: str) -> int | None:
+        '''Return unix time (ms) of the last stored point of pair.'''
+
+        meta = self.pairs.find_one({'pair_name': pair}, {'_id': 0, 'last_ts': 1}) or {}
+        return meta.get('last_ts')
+
+    def _store(self, pair: str, data: dict, last_ts: int | None = None) -> int:
+        '''Append points newer than {last_ts}. Return number of new points.
+
+        CoinGecko ends hourly data with a live point taken at request time,
+        it is off the hourly grid, so points from the current hour are skipped.
+        Documents are built as price_documents of fastapi app does.'''
+
+        hour_start = int(time.time()) // 3600 * 3600 * 1000
+        docs = [
+            {
+                'ts': datetime.fromtimestamp(price[0] / 1000, tz=timezone.utc),
+                'pair_name': pair,
+                'price': price[1],
+                'market_cap': cap[1],
+                'total_volume': volume[1]
+            }
+            for price, cap, volume in zip(data['prices'], data['market_caps'], data['total_volumes'])
+            if (last_ts is None or price[0] > last_ts) and price[0] < hour_start
+        ]
 
-        pair_data: dict = resp.json()
-        if pair_data.get('prices'):
-            return pair_data
-        else:
-            raise GeckoCoinAPIException('Pair data update fail')
+        if docs:
+            self.prices.insert_many(docs)
+            self.pairs.update_one(
+                {'pair_name': pair},
+                {'$set': {'last_ts': round(docs[-1]['ts'].timestamp() * 1000)}},
+                upsert=True
+            )
+        return len(docs)
+
+    async def _update_pair(self,
+                           session: aiohttp.ClientSession,
+                           limiter: TokenBucket,
+                           semaphore: asyncio.Semaphore,
+                           pair: str,
+                           progress: dict) -> int:
+        async with semaphore:
+            last_ts = await asyncio.to_thread(self._last_ts, pair)
+            data = await self._request(session, limiter, pair, last_ts)
+            res = await asyncio.to_thread(self._store, pair, data, last_ts)
+        progress['done'] += 1
+        logger.info(f"[{progress['done']}/{progress['total']}] Pair {pair} updated, new points: {res}")
+        return res
+
+    async def _update_all(self) -> None:
+        pairs = list(self._pairs_update | self._pairs_insert)
+        limiter = TokenBucket(rate=GECKO_CALLS_PER_MINUTE / 60, capacity=GECKO_BURST)
+        semaphore = asyncio.Semaphore(GECKO_CONCURRENCY)
+        progress = {'done': 0, 'total': len(pairs)}
+
+        async with aiohttp.ClientSession() as session:
+            results = await asyncio.gather(
+                *[self._update_pair(session, limiter, semaphore, el, progress) for el in pairs],
+                return_exceptions=True
+            )
+
+        failed = [pair for pair, res in zip(pairs, results) if isinstance(res, BaseException)]
+        if failed:
+            raise GeckoCoinAPIException(f'Pairs update fail: {failed}')
 
     def update_data(self) -> None:
+        '''Refresh all pairs concurrently, as fast as the CoinGecko quota allows.'''
+
         print('Start updating')
-        for el in self._pairs_update:
-            res = self.pairs.update_one(
-                {'pair_name': el},
-                {'$set': {'data': self._request(el)}}
+        asyncio.run(self._update_all())
+
+    @staticmethod
+    def warm_charts(top: int = CHART_WARM_TOP) -> dict | None:
+        '''Ask FastAPI to pre-render the most requested charts with fresh data.
+
+        The warm-up runs as a FastAPI delivery job. Return the queued job,
+        its result is the warm-up summary.'''
+
+        try:
+            resp = requests.post(
+                f'http://{FASTAPI}/pair/warm_charts',
+                params={'top': top},
+                headers={'accept': 'application/json'},
+                timeout=CHART_WARM_TIMEOUT
             )
-            logger.info(f'Pair {el} updated, ID: {res.upserted_id}')
-            logger.debug('Wait for 10 seconds')
-            time.sleep(10)
-        for el in self._pairs_insert:
-            res = self.pairs.insert_one({
-                'pair_name': el,
-                'data': self._request(el)
-            })
-            logger.info(f'Pair {el} inserted, ID: {res.inserted_id}')
-            logger.debug('Wait for 10 seconds')
-            time.sleep(10)
+        except requests.RequestException as e:
+            logger.warning(f'Charts warm-up failed: {e}')
+            return None
+        if resp.status_code != 202:
+            logger.warning(f'Charts warm-up failed: {resp.status_code} {resp.text}')
+            return None
+        job = resp.json()['detail']
+        logger.info(f"Charts warm-up queued, job {job['job_id']}")
+        return job
 
     @staticmethod
     def admin_notification(result: str):
@@ -100,26 +233,119 @@ class PairTask:
 
 class ModelTask:
 
-    def __init__(self, mlflow_server: str = MLFLOW_SERVER, mlflow_client: str = MLFLOW_CLIENT) -> None:
+    def __init__(self,
+                 mlflow_server: str = MLFLOW_SERVER,
+                 mlflow_client: str = MLFLOW_CLIENT,
+                 address: str = MONGO,
+                 port: int = 27017,
+                 database: str = 'main_database',
+                 pairs: str = 'pairs') -> None:
         '''Get all experiment names and do new runs'''
 
         self.mlflow_server = mlflow_server
         self.mlflow_client = mlflow_client
+        self.pairs = MongoClient(address, port).get_database(database).get_collection(pairs)
+        self.exp = self._experiments()
+
+    def _experiments(self) -> dict[str, str]:
+        '''Return {name: experiment_id} of all pair experiments, page by page.'''
+
+        experiments = {}
+        data = {'max_results': 100}
+        while True:
+            resp = requests.post(
+                f'http://{self.mlflow_server}:5000/api/2.0/mlflow/experiments/search',
+                json=data,
+                headers={'accept': 'application/json'}
+            )
+            if resp.status_code != 200:
+                break
+            resp = resp.json()
+            experiments.update({
+                el['name']: el['experiment_id'] for el in resp.get('experiments', []) if '-' in el['name']
+            })
+            if not resp.get('next_page_token'):
+                break
+            data['page_token'] = resp['next_page_token']
+        return experiments
+
+    def _is_fresh(self, pair: str, exp_id: str) -> bool:
+        '''Check if the latest finished run was fitted on the latest stored point.'''
+
+        meta = self.pairs.find_one({'pair_name': pair}, {'_id': 0, 'last_ts': 1}) or {}
+        if meta.get('last_ts') is None:
+            return False
+
         resp = requests.post(
-            f'http://{self.mlflow_server}:5000/api/2.0/mlflow/experiments/search',
-            json={'max_results': 100},
-            headers={'accept': 'application/json'}
+            f'http://{self.mlflow_server}:5000/api/2.0/mlflow/runs/search',
+            json={
+                'experiment_ids': [exp_id],
+                'filter': "attributes.status = 'FINISHED'",
+                'max_results': 1,
+                'order_by': ['attributes.start_time DESC']
+            }
         )
-        if resp.status_code == 200:
-            resp = resp.json()
-            self.exp = {el['name'] for el in resp['experiments']}
+        if resp.status_code != 200 or not resp.json().get('runs'):
+            return False
 
-    def do_runs(self) -> None:
-        for el in self.exp:
-            COIN_ID, VS_CURRENCY = el.split('-')
-            resp = requests.post(
-                f'http://{self.mlflow_client}:80/prophet/do_run',
-                params={'coin_id': COIN_ID, 'vs_currency': VS_CURRENCY})
-            if resp.status_code == 200:
-                resp = resp.json()['detail']['model_uri']
-                logger.info(f'Success run for {el}, model URI: {resp}')
+        params = {el['key']: el['value'] for el in resp.json()['runs'][0]['data'].get('params', [])}
+        return params.get('data_last_ts') == str(meta['last_ts'])
+
+    def _train(self, pair: str) -> str:
+        '''Queue a run in mlflow client and wait for it. Return job status.'''
+
+        COIN_ID, VS_CURRENCY = pair.rsplit('-', 1)
+        resp = requests.post(
+            f'http://{self.mlflow_client}:80/prophet/do_run',
+            params={'coin_id': COIN_ID, 'vs_currency': VS_CURRENCY})
+        if resp.status_code != 202:
+            return 'failed'
+
+        job = resp.json()['detail']
+        # a queued job waits for a free train worker, time only the run itself
+        deadline = None
+        while job['status'] in ('queued', 'running'):
+            if job['status'] == 'running' and deadline is None:
+                deadline = time.monotonic() + MODEL_JOB_TIMEOUT
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(MODEL_POLL_INTERVAL)
+            resp = requests.get(f"http://{self.mlflow_client}:80/prophet/jobs/{job['job_id']}")
+            if resp.status_code != 200:
+                return 'failed'
+            job = resp.json()['detail']
+        if job['status'] == 'finished':
+            logger.info(f"Success run for {pair}, model URI: {job['result']['detail']['model_uri']}")
+        return job['status']
+
+    def _run_pair(self, pair: str, exp_id: str) -> dict:
+        start = time.perf_counter()
+        try:
+            status = 'skipped' if self._is_fresh(pair, exp_id) else self._train(pair)
+        except requests.RequestException as e:
+            logger.warning(f'Run for {pair} failed: {e}')
+            status = 'failed'
+        return {'pair': pair, 'status': status, 'seconds': round(time.perf_counter() - start, 1)}
+
+    def do_runs(self) -> dict:
+        '''Retrain pairs with new data, MODEL_WORKERS pairs at a time.
+
+        The fits run in mlflow client training workers, TRAIN_WORKERS at a time.
+        Return a summary with wall time per pair.'''
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=MODEL_WORKERS) as pool:
+            results = list(pool.map(lambda el: self._run_pair(*el), self.exp.items()))
+
+        summary = {
+            'seconds': round(time.perf_counter() - start, 1),
+            'trained': sum(el['status'] == 'finished' for el in results),
+            'skipped': sum(el['status'] == 'skipped' for el in results),
+            'failed': sum(el['status'] not in ('finished', 'skipped') for el in results),
+            'pairs': results
+        }
+        for el in sorted(results, key=lambda el: el['seconds'], reverse=True):
+            logger.info(f"{el['pair']}: {el['status']} in {el['seconds']} s")
+        logger.info(f"Retraining done in {summary['seconds']} s: {summary['trained']} trained, "
+                    f"{summary['skipped']} skipped, {summary['failed']} failed")
+        return summary